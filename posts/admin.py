@@ -1,13 +1,23 @@
 from django.contrib import admin
 from .models import Post, Comment
+from . import search
 
 
 class PostAdmin(admin.ModelAdmin):
-    list_display = ("pk", "text", "pub_date", "author")
+    list_display = ("pk", "text", "pub_date", "author", "comment_count")
     search_fields = ("text", )
     list_filter = ("pub_date", )
+    # счётчик ведут сигналы комментариев, а поля картинки — пул миниатюр,
+    # руками их не правят
+    readonly_fields = ("comment_count", "image_width", "image_height", "image_placeholder", "image_variants")
     empty_value_display = "-пусто-"
 
+    def get_search_results(self, request, queryset, search_term):
+        # LIKE '%...%' по тексту читает всю таблицу, индекс FTS5 — нет
+        if not search_term or not search.available() or not search.to_match(search_term):
+            return super().get_search_results(request, queryset, search_term)
+        return queryset.filter(pk__in=search.matching_ids(search_term)), False
+
 
 class CommentAdmin(admin.ModelAdmin):
     list_display = ('pk', 'created', 'post', 'author', 'text', )
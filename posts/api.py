@@ -0,0 +1,167 @@
+"""
+JSON API только для чтения: ленты, пост и комментарии. Строки читаются
+через values() — без сборки моделей и рендера шаблонов, — страницы
+курсорные, как у HTML-лент, а ETag/Last-Modified и кеш страниц для
+анонимов те же, что у соответствующих HTML-страниц.
+"""
+import functools
+
+from django.conf import settings
+from django.http import JsonResponse
+from django.views.decorators.http import require_GET
+
+from . import pagecache, timeline
+from .conditional import versioned
+from .models import Comment, Post, Timeline
+from .paginator import CursorPaginator
+from .views import follow_scopes, group_scopes, index_scopes, profile_scopes
+
+MAX_PER_PAGE = 100
+ORDERING = ('-pub_date', '-id')
+POST_FIELDS = ('id', 'text', 'pub_date', 'author__username', 'group__slug', 'comment_count',
+               'image', 'image_width', 'image_height')
+COMMENT_FIELDS = ('id', 'text', 'created', 'author__username')
+IMAGE_STORAGE = Post._meta.get_field('image').storage
+
+
+def _post(row, prefix=''):
+    image = row[f'{prefix}image']
+    return {
+        'id': row[f'{prefix}id'],
+        'author': row[f'{prefix}author__username'],
+        'group': row[f'{prefix}group__slug'],
+        'text': row[f'{prefix}text'],
+        'pub_date': row[f'{prefix}pub_date'].isoformat(),
+        'comment_count': row[f'{prefix}comment_count'],
+        'image': {
+            'url': IMAGE_STORAGE.url(image),
+            'width': row[f'{prefix}image_width'],
+            'height': row[f'{prefix}image_height'],
+        } if image else None,
+    }
+
+
+def _posts(rows):
+    return [_post(row) for row in rows]
+
+
+def _timeline_posts(rows):
+    return [_post(row, 'post__') for row in rows]
+
+
+def _comments(rows):
+    return [{
+        'id': row['id'],
+        'author': row['author__username'],
+        'text': row['text'],
+        'created': row['created'].isoformat(),
+    } for row in rows]
+
+
+def _per_page(request):
+    try:
+        per_page = int(request.GET.get('limit', settings.POSTS_PER_PAGE))
+    except ValueError:
+        per_page = settings.POSTS_PER_PAGE
+    return max(1, min(per_page, MAX_PER_PAGE))
+
+
+def _page(request, paginator):
+    page = paginator.get_page(after=request.GET.get('after'), before=request.GET.get('before'))
+    return JsonResponse({
+        'results': page.object_list,
+        'next': page.next_cursor(),
+        'previous': page.previous_cursor(),
+    })
+
+
+def _post_feed(request, queryset):
+    paginator = CursorPaginator(queryset.values(*POST_FIELDS), _per_page(request), ordering=ORDERING,
+                                transform=_posts)
+    return _page(request, paginator)
+
+
+def _not_found():
+    return JsonResponse({'detail': 'Не найдено'}, status=404)
+
+
+def login_required(view):
+    # API не перенаправляет на форму входа, а отвечает 403
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({'detail': 'Нужно войти'}, status=403)
+        return view(request, *args, **kwargs)
+    return wrapper
+
+
+def post_scopes(request, post_id):
+    return [f'post:{post_id}', 'names']
+
+
+@require_GET
+@versioned(index_scopes)
+def index(request):
+    pagecache.tag(request, 'posts')
+    return _post_feed(request, Post.objects.all())
+
+
+@require_GET
+@versioned(group_scopes)
+def group_posts(request, slug):
+    group = request.group
+    if group is None:
+        return _not_found()
+    pagecache.tag(request, f'group:{group.pk}', 'names')
+    return _post_feed(request, Post.objects.filter(group=group))
+
+
+@require_GET
+@versioned(profile_scopes)
+def profile_posts(request, username):
+    user = request.profile_user
+    if user is None:
+        return _not_found()
+    pagecache.tag(request, f'author:{user.pk}', 'names')
+    return _post_feed(request, Post.objects.filter(author=user))
+
+
+@require_GET
+@login_required
+@versioned(follow_scopes)
+def follow_index(request):
+    per_page = _per_page(request)
+    # как timeline.paginator, только строки — словари из values()
+    streams = [
+        CursorPaginator(Post.objects.filter(author_id=author_id).values(*POST_FIELDS), per_page,
+                        ordering=ORDERING, transform=_posts)
+        for author_id, pulled in request.followed_authors
+        if pulled
+    ]
+    entries = Timeline.objects.filter(user=request.user).values(
+        'pub_date', 'post_id', *(f'post__{name}' for name in POST_FIELDS)
+    )
+    paginator = CursorPaginator(entries, per_page, ordering=timeline.ORDERING, transform=_timeline_posts,
+                                streams=streams)
+    return _page(request, paginator)
+
+
+@require_GET
+@versioned(post_scopes)
+def post_detail(request, post_id):
+    pagecache.tag(request, f'post:{post_id}', 'names')
+    row = Post.objects.filter(pk=post_id).values(*POST_FIELDS).first()
+    if row is None:
+        return _not_found()
+    return JsonResponse(_post(row))
+
+
+@require_GET
+@versioned(post_scopes)
+def post_comments(request, post_id):
+    if not Post.objects.filter(pk=post_id).exists():
+        return _not_found()
+    pagecache.tag(request, f'post:{post_id}', 'names')
+    comments = Comment.objects.filter(post_id=post_id).values(*COMMENT_FIELDS)
+    paginator = CursorPaginator(comments, _per_page(request), ordering=('created', 'id'), transform=_comments)
+    return _page(request, paginator)
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class PostConfig(AppConfig):
     name = 'posts'
+
+    def ready(self):
+        from . import metrics, signals  # noqa: F401
+        metrics.install()
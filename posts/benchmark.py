@@ -0,0 +1,135 @@
+"""
+Замеры представлений через тестовый клиент на текущей базе (например,
+после seed_load): задержка p50/p95 и число SQL-запросов для каждого
+маршрута posts/urls.py. Результат — словарь, пригодный для JSON, его
+можно сравнить с прошлым прогоном и увидеть регрессии.
+"""
+import math
+import statistics
+import time
+
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from . import urls
+from .models import Comment, Group, Post, User, UserStats
+from .paginator import encode_cursor
+
+# маршруты, которые меняют данные или держат поток открытым, не замеряются
+SKIPPED = {
+    'add_comment': 'создаёт комментарий',
+    'profile_follow': 'создаёт подписку',
+    'profile_unfollow': 'удаляет подписку',
+    'feed_events': 'бесконечный поток',
+    'export': 'выгрузка всего аккаунта',
+    'metrics': 'служебная страница для персонала',
+}
+
+
+def percentile(values, share):
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(share * len(ordered)) - 1)]
+
+
+def _sample():
+    """Представительные объекты: самые активные автор, группа, пост и читатель"""
+    author = User.objects.get(pk=UserStats.objects.order_by('-posts_count').values_list('user_id', flat=True)[0])
+    reader = User.objects.get(pk=UserStats.objects.order_by('-following_count').values_list('user_id', flat=True)[0])
+    group = Group.objects.annotate(n=Count('posts')).order_by('-n').first()
+    post = Post.objects.select_related('author').order_by('-comment_count', '-pk').first()
+    deep = Post.objects.order_by('-pub_date', '-pk').values_list('pub_date', 'pk')[1000:1001].first()
+    word = Post.objects.values_list('text', flat=True).first().split()[0]
+    return author, reader, group, post, deep, word
+
+
+def targets():
+    """[(имя, url, вошедший пользователь или None)] для всех маршрутов posts/urls.py"""
+    author, reader, group, post, deep, word = _sample()
+    post_kwargs = {'username': post.author.username, 'post_id': post.pk}
+    found = {
+        'index': [('index', reverse('index'), None)],
+        'group': [('group', reverse('group', kwargs={'slug': group.slug}), None)] if group else [],
+        'new': [('new', reverse('new'), reader)],
+        'follow_index': [('follow_index', reverse('follow_index'), reader)],
+        'search': [('search', f"{reverse('search')}?q={word}", None)],
+        'profile': [('profile', reverse('profile', kwargs={'username': author.username}), None)],
+        'post': [('post', reverse('post', kwargs=post_kwargs), None)],
+        'post_edit': [('post_edit', reverse('post_edit', kwargs=post_kwargs), post.author)],
+        'api_index': [('api_index', reverse('api_index'), None)],
+        'api_post': [('api_post', reverse('api_post', kwargs={'post_id': post.pk}), None)],
+        'api_comments': [('api_comments', reverse('api_comments', kwargs={'post_id': post.pk}), None)],
+        'api_group': [('api_group', reverse('api_group', kwargs={'slug': group.slug}), None)] if group else [],
+        'api_profile': [('api_profile', reverse('api_profile', kwargs={'username': author.username}), None)],
+        'api_follow_index': [('api_follow_index', reverse('api_follow_index'), reader)],
+    }
+    if deep:
+        # глубокая страница: курсорная пагинация не должна дорожать с глубиной
+        found['index'].append(('index_deep', f"{reverse('index')}?after={encode_cursor(deep)}", None))
+    result, skipped = [], dict(SKIPPED)
+    for pattern in urls.urlpatterns:
+        if pattern.name in found:
+            result.extend(found[pattern.name])
+        elif pattern.name not in skipped:
+            skipped[pattern.name] = 'нет сценария замера'
+    return result, skipped
+
+
+def measure(url, user, repeat, warmup, cold):
+    client = Client()
+    if user is not None:
+        client.force_login(user)
+    timings, queries, statuses = [], [], set()
+    for i in range(warmup + repeat):
+        if cold:
+            cache.clear()
+        with CaptureQueriesContext(connection) as captured:
+            start = time.perf_counter()
+            response = client.get(url)
+            if response.streaming:
+                b''.join(response.streaming_content)
+            elapsed = time.perf_counter() - start
+        if i >= warmup:
+            timings.append(elapsed * 1000)
+            queries.append(len(captured))
+            statuses.add(response.status_code)
+    return {
+        'url': url,
+        'status': sorted(statuses),
+        'p50_ms': round(percentile(timings, 0.5), 3),
+        'p95_ms': round(percentile(timings, 0.95), 3),
+        'mean_ms': round(statistics.mean(timings), 3),
+        'queries': max(queries),
+    }
+
+
+def run(repeat=20, warmup=2, cold=False, only=None):
+    found, skipped = targets()
+    results = {}
+    for name, url, user in found:
+        if only and name not in only:
+            continue
+        results[name] = measure(url, user, repeat, warmup, cold)
+    return {
+        'config': {'repeat': repeat, 'warmup': warmup, 'cold_cache': cold},
+        'data': {'users': User.objects.count(), 'posts': Post.objects.count(), 'comments': Comment.objects.count()},
+        'results': results,
+        'skipped': skipped,
+    }
+
+
+def compare(current, baseline, tolerance):
+    """Регрессии относительно прошлого прогона: медленнее на tolerance или больше запросов"""
+    regressions = []
+    for name, result in current['results'].items():
+        before = baseline.get('results', {}).get(name)
+        if before is None:
+            continue
+        if result['queries'] > before['queries']:
+            regressions.append(f"{name}: запросов {before['queries']} -> {result['queries']}")
+        if result['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {before['p95_ms']} мс -> {result['p95_ms']} мс")
+    return regressions
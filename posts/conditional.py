@@ -0,0 +1,68 @@
+"""
+Валидаторы ETag/Last-Modified для лент и страницы поста. Они строятся из
+версий данных (posts/versions.py), поэтому на повторный запрос с
+If-None-Match или If-Modified-Since ответ 304 отдаётся до тяжёлых запросов
+и рендера: нужно только найти id группы/автора и прочитать версии из кеша.
+"""
+import datetime
+import functools
+import hashlib
+
+from django.conf import settings
+from django.utils import timezone
+from django.views.decorators.http import condition
+
+from . import versions
+
+
+def versioned(scopes_func):
+    """
+    scopes_func(request, *args, **kwargs) возвращает список областей версий,
+    от которых зависит страница, или None, если страницы нет (тогда
+    валидаторов нет и представление само ответит 404).
+    """
+
+    def current(request, *args, **kwargs):
+        if not hasattr(request, '_page_versions'):
+            scopes = scopes_func(request, *args, **kwargs)
+            request._page_versions = None if scopes is None else versions.get_many(scopes)
+        return request._page_versions
+
+    def etag(request, *args, **kwargs):
+        found = current(request, *args, **kwargs)
+        if found is None:
+            return None
+        # страница зависит и от того, кто смотрит: ссылки правки, меню, csrf-токен
+        viewer = request.user.pk if request.user.is_authenticated else ''
+        csrf = request.COOKIES.get(settings.CSRF_COOKIE_NAME, '')
+        raw = f'{request.get_full_path()}|{viewer}|{csrf}|' + '|'.join(
+            f'{scope}={found[scope]}' for scope in sorted(found)
+        )
+        return hashlib.md5(raw.encode()).hexdigest()
+
+    def last_modified(request, *args, **kwargs):
+        # для вошедших пользователей достаточно ETag: дата изменения данных
+        # не учитывает вход и выход, и If-Modified-Since вернул бы чужую страницу
+        if request.user.is_authenticated:
+            return None
+        found = current(request, *args, **kwargs)
+        if not found:
+            return None
+        micros = max(found.values())
+        return datetime.datetime.fromtimestamp(micros / 1000000, tz=timezone.utc)
+
+    def decorator(view):
+        conditional = condition(etag_func=etag, last_modified_func=last_modified)(view)
+
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            response = conditional(request, *args, **kwargs)
+            # валидаторы только у настоящей страницы: иначе клиент получил бы
+            # 304 на повторный запрос несуществующего поста
+            if response.status_code not in (200, 304):
+                del response['ETag']
+                del response['Last-Modified']
+            return response
+        return wrapper
+
+    return decorator
@@ -0,0 +1,9 @@
+from django.conf import settings
+
+
+def feed_cache(request):
+    return {'feed_cache_timeout': settings.FEED_CACHE_TIMEOUT}
+
+
+def live_feed(request):
+    return {'live_feed_enabled': settings.LIVE_FEED_ENABLED}
@@ -0,0 +1,93 @@
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from . import versions
+from .models import Comment, Follow, Post, User, UserStats
+
+BATCH_SIZE = 1000
+
+
+def bump(user_id, **deltas):
+    """Атомарно сдвигает счётчики пользователя: bump(1, posts_count=1)."""
+    # ниже нуля не уходим, даже если счётчик успел разойтись с данными;
+    # отсутствующую строку (пользователь удаляется каскадом) не трогаем
+    UserStats.objects.filter(pk=user_id).update(
+        **{name: Greatest(F(name) + delta, 0) for name, delta in deltas.items()}
+    )
+    versions.bump(f'stats:{user_id}')
+
+
+def bump_comments(post_id, delta):
+    Post.objects.filter(pk=post_id).update(comment_count=Greatest(F('comment_count') + delta, 0))
+
+
+def stats_for(user):
+    try:
+        return user.stats
+    except UserStats.DoesNotExist:
+        reconcile([user.pk])
+        user.stats = UserStats.objects.get(pk=user.pk)
+        return user.stats
+
+
+def _counts(queryset, field, user_ids):
+    rows = queryset.filter(**{f'{field}__in': user_ids}).values(field).annotate(n=Count('pk')).order_by()
+    return {row[field]: row['n'] for row in rows}
+
+
+def reconcile(user_ids=None):
+    """
+    Пересчитывает счётчики пачками по BATCH_SIZE пользователей: три
+    группирующих запроса и один bulk_update на пачку.
+    """
+    if user_ids is None:
+        user_ids = User.objects.order_by('pk').values_list('pk', flat=True).iterator()
+    user_ids = iter(user_ids)
+    total = 0
+    while True:
+        batch = [pk for _, pk in zip(range(BATCH_SIZE), user_ids)]
+        if not batch:
+            return total
+        posts = _counts(Post.objects, 'author_id', batch)
+        followers = _counts(Follow.objects, 'author_id', batch)
+        following = _counts(Follow.objects, 'user_id', batch)
+        stats = [
+            UserStats(
+                user_id=pk,
+                posts_count=posts.get(pk, 0),
+                followers_count=followers.get(pk, 0),
+                following_count=following.get(pk, 0),
+            )
+            for pk in batch
+        ]
+        with transaction.atomic():
+            UserStats.objects.bulk_create(stats, ignore_conflicts=True)
+            UserStats.objects.bulk_update(stats, ['posts_count', 'followers_count', 'following_count'])
+        versions.bump(*(f'stats:{pk}' for pk in batch))
+        total += len(batch)
+
+
+def reconcile_comments(post_ids=None):
+    """
+    Пересчитывает Post.comment_count диапазонами по BATCH_SIZE постов: один
+    UPDATE с коррелированным подзапросом на диапазон (по индексу Comment.post).
+    post_ids — только эти посты, иначе все.
+    """
+    counts = Comment.objects.filter(post=OuterRef('pk')).values('post').annotate(n=Count('pk')).values('n')
+    if post_ids is None:
+        posts = Post.objects.order_by('pk').values_list('pk', flat=True).iterator()
+    else:
+        posts = iter(sorted(post_ids))
+    total = 0
+    while True:
+        batch = [pk for _, pk in zip(range(BATCH_SIZE), posts)]
+        if not batch:
+            return total
+        selected = Post.objects.filter(pk__gte=batch[0], pk__lte=batch[-1])
+        if post_ids is not None:
+            selected = selected.filter(pk__in=batch)
+        selected.exclude(
+            comment_count=Coalesce(Subquery(counts), 0)
+        ).update(comment_count=Coalesce(Subquery(counts), 0))
+        total += len(batch)
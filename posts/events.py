@@ -0,0 +1,67 @@
+"""
+Шина событий в памяти процесса для живых лент (Server-Sent Events). Пост
+после коммита публикуется в шину, открытые потоки /events/ получают его из
+своих очередей. Последние события хранятся в кольцевом буфере, чтобы
+переподключившийся клиент (заголовок Last-Event-ID) ничего не потерял.
+
+Шина не выходит за пределы процесса: при нескольких процессах сервера
+читатель узнаёт только о постах, опубликованных через его процесс.
+"""
+import collections
+import itertools
+import queue
+import threading
+
+HISTORY = 100      # событий в буфере для переподключения
+QUEUE_SIZE = 100   # медленный читатель теряет события, а не держит память
+
+_lock = threading.Lock()
+_ids = itertools.count(1)
+_history = collections.deque(maxlen=HISTORY)
+_subscribers = set()
+
+
+def publish(event):
+    """Разослать событие (словарь) всем подписчикам; возвращает его id"""
+    with _lock:
+        event = dict(event, id=next(_ids))
+        _history.append(event)
+        subscribers = list(_subscribers)
+    for subscriber in subscribers:
+        try:
+            subscriber.put_nowait(event)
+        except queue.Full:
+            pass
+    return event['id']
+
+
+def subscribe(last_id=None):
+    """
+    Новая очередь подписчика. Если передан last_id, в неё сразу кладутся
+    события из буфера, пришедшие после него.
+    """
+    subscriber = queue.Queue(maxsize=QUEUE_SIZE)
+    with _lock:
+        if last_id is not None:
+            for event in _history:
+                if event['id'] > last_id:
+                    subscriber.put_nowait(event)
+        _subscribers.add(subscriber)
+    return subscriber
+
+
+def unsubscribe(subscriber):
+    with _lock:
+        _subscribers.discard(subscriber)
+
+
+def post_event(post):
+    # только то, что нужно для уведомления; карточку клиент получит с лентой
+    return {
+        'type': 'post',
+        'post_id': post.pk,
+        'author_id': post.author_id,
+        'author': post.author.username,
+        'group_id': post.group_id,
+        'text': post.text[:200],
+    }
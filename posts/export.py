@@ -0,0 +1,98 @@
+"""
+Выгрузка постов и комментариев пользователя в JSONL или ZIP (JSONL плюс
+картинки). Всё отдаётся генераторами: строки читаются из базы через
+iterator(chunk_size=...), архив пишется в поток без временных файлов,
+поэтому память не зависит от размера аккаунта и первые байты уходят сразу.
+Формат строк тот же, что понимает команда import_content: комментарии к
+своему посту идут сразу за ним, комментарии к чужим постам — в конце.
+"""
+import datetime
+import json
+import logging
+import zipfile
+
+from .models import Comment, Group, Post
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 2000
+IMAGE_STORAGE = Post._meta.get_field('image').storage
+
+
+def _line(row):
+    return (json.dumps(row, ensure_ascii=False, default=datetime.datetime.isoformat) + '\n').encode()
+
+
+def _comment(comment, username):
+    return _line({'type': 'comment', 'id': comment['id'], 'post': comment['post_id'], 'author': username,
+                  'text': comment['text'], 'created': comment['created']})
+
+
+def jsonl(user):
+    yield _line({'type': 'user', 'username': user.username, 'email': user.email,
+                 'first_name': user.first_name, 'last_name': user.last_name, 'date_joined': user.date_joined})
+    groups = Group.objects.filter(posts__author=user).distinct().order_by('pk')
+    for group in groups.values('slug', 'title', 'description').iterator(chunk_size=CHUNK_SIZE):
+        yield _line(dict(group, type='group'))
+    posts = user.posts.order_by('pk').values('id', 'text', 'pub_date', 'group__slug', 'image')
+    fields = ('id', 'post_id', 'text', 'created')
+    # оба потока упорядочены по id поста: комментарии раскладываются за
+    # своими постами слиянием, без словаря в памяти
+    own = Comment.objects.filter(author=user, post__author=user).order_by('post_id', 'pk').values(*fields)
+    own = own.iterator(chunk_size=CHUNK_SIZE)
+    comment = next(own, None)
+    for post in posts.iterator(chunk_size=CHUNK_SIZE):
+        yield _line({'type': 'post', 'id': post['id'], 'author': user.username, 'group': post['group__slug'],
+                     'text': post['text'], 'pub_date': post['pub_date'], 'image': post['image'] or None})
+        while comment is not None and comment['post_id'] == post['id']:
+            yield _comment(comment, user.username)
+            comment = next(own, None)
+    # комментарии к чужим постам — тоже контент пользователя; загрузка их
+    # пропустит, постов для них в файле нет
+    foreign = Comment.objects.filter(author=user).exclude(post__author=user).order_by('pk').values(*fields)
+    for comment in foreign.iterator(chunk_size=CHUNK_SIZE):
+        yield _comment(comment, user.username)
+
+
+class _Sink:
+    """Файл только на запись для zipfile: копит байты, пока их не заберёт генератор"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def zip_archive(user):
+    sink = _Sink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        with archive.open('content.jsonl', 'w', force_zip64=True) as entry:
+            for line in jsonl(user):
+                entry.write(line)
+                if sink.chunks:
+                    yield sink.pop()
+        # второй проход вместо набора имён в памяти: картинки уже сжаты, их не пережимаем
+        images = user.posts.exclude(image='').exclude(image=None).order_by('image').values_list('image', flat=True)
+        for name in images.distinct().iterator(chunk_size=CHUNK_SIZE):
+            info = zipfile.ZipInfo(f'images/{name}', datetime.datetime.now().timetuple()[:6])
+            info.compress_type = zipfile.ZIP_STORED
+            try:
+                source = IMAGE_STORAGE.open(name)
+            except OSError:
+                logger.warning('Картинки %s нет в хранилище, в архив она не попала', name)
+                continue
+            with source, archive.open(info, 'w', force_zip64=True) as entry:
+                for chunk in source.chunks():
+                    entry.write(chunk)
+                    yield sink.pop()
+    yield sink.pop()
@@ -1,7 +1,49 @@
+import io
+import os
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile, UploadedFile
 from django.forms import ModelForm
+from PIL import Image, ImageOps
+
 from .models import Comment, Post
 
 
+def normalize_image(upload):
+    """
+    Уменьшает картинку до POST_IMAGE_MAX_SIZE по большей стороне и
+    пересохраняет её без метаданных (EXIF, GPS и прочего): JPEG с качеством
+    POST_IMAGE_UPLOAD_QUALITY, а картинки с прозрачностью — PNG.
+    """
+    upload.seek(0)
+    try:
+        with Image.open(upload) as image:
+            # Image.open читает только заголовок: размер известен до декодирования
+            width, height = image.size
+            if width * height > settings.POST_IMAGE_MAX_PIXELS:
+                raise ValidationError(
+                    'Картинка слишком большая: %(width)s×%(height)s точек.',
+                    code='too_many_pixels', params={'width': width, 'height': height},
+                )
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((settings.POST_IMAGE_MAX_SIZE, settings.POST_IMAGE_MAX_SIZE), Image.LANCZOS)
+            transparent = 'A' in image.getbands() or 'transparency' in image.info
+            buffer = io.BytesIO()
+            if transparent:
+                image.convert('RGBA').save(buffer, 'PNG', optimize=True)
+                extension, content_type = 'png', 'image/png'
+            else:
+                image.convert('RGB').save(buffer, 'JPEG', quality=settings.POST_IMAGE_UPLOAD_QUALITY, optimize=True)
+                extension, content_type = 'jpg', 'image/jpeg'
+    except (OSError, Image.DecompressionBombError):
+        # проверка ImageField смотрит только заголовок: оборванный или
+        # испорченный файл падает уже при декодировании
+        raise ValidationError('Не удалось прочитать картинку: файл повреждён.', code='invalid_image')
+    stem = os.path.splitext(os.path.basename(upload.name))[0]
+    return SimpleUploadedFile(f'{stem}.{extension}', buffer.getvalue(), content_type)
+
+
 class PostForm(ModelForm):
     class Meta:
         model = Post
@@ -10,6 +52,13 @@ class PostForm(ModelForm):
             'group': 'Группа',
         }
 
+    def clean_image(self):
+        image = self.cleaned_data['image']
+        # при правке без новой картинки здесь уже сохранённый файл
+        if isinstance(image, UploadedFile):
+            image = normalize_image(image)
+        return image
+
 
 class CommentForm(ModelForm):
     class Meta:
@@ -0,0 +1,233 @@
+"""
+Массовая загрузка контента из JSONL: по объекту на строку, поле "type" —
+user, group, post, comment или follow (формат совпадает с выгрузкой
+posts.export). Строки копятся в пачки и пишутся bulk_create, каждая
+пачка — в своей транзакции; сигналы при этом не срабатывают, поэтому
+счётчики пользователей, ленты подписок и версии кеша пересчитываются
+один раз в конце и только для затронутых пользователей — и тогда, когда загрузка
+оборвалась на плохой строке: уже записанные пачки остаются в базе. Число
+комментариев и поисковый индекс обновляются вместе с каждой пачкой.
+
+Логины и слаги групп переводятся в id по словарям в памяти. Посты
+получают новые id, а "id" из файла — только ключ, по которому на пост
+ссылаются его комментарии. Они идут сразу за постом, как их пишет
+выгрузка, поэтому помнить нужно только id постов двух последних пачек;
+комментарии к другим постам пропускаются. Остальное в памяти не
+задерживается.
+"""
+import contextlib
+import json
+
+from django.contrib.auth.hashers import make_password
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from users import autocomplete
+
+from . import counters, search, timeline, versions
+from .models import Comment, Follow, Group, Post, User
+
+BATCH_SIZE = 5000
+ORDER = ('user', 'group', 'post', 'comment', 'follow')
+
+
+class BadRow(Exception):
+    pass
+
+
+@contextlib.contextmanager
+def original_dates():
+    # даты публикации берутся из файла, а не ставятся текущими
+    fields = [Post._meta.get_field('pub_date'), Comment._meta.get_field('created')]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+class Importer:
+    def __init__(self, batch_size=BATCH_SIZE):
+        self.batch_size = batch_size
+        self.users = dict(User.objects.values_list('username', 'pk'))
+        self.groups = dict(Group.objects.values_list('slug', 'pk'))
+        self.posts = {}        # id поста в файле -> id в базе, две последние пачки
+        self.recent_posts = {}
+        self.pending = {kind: [] for kind in ORDER}
+        self.counts = dict.fromkeys(ORDER, 0)
+        self.counts['skipped'] = 0
+        self.authors = set()   # чьи ленты и счётчики надо пересчитать
+        self.counted = set()   # у кого пересчитать только счётчики
+        self.groups_changed = set()
+
+    def _user_id(self, username):
+        try:
+            return self.users[username]
+        except KeyError:
+            raise BadRow(f'неизвестный пользователь {username!r}')
+
+    def _date(self, value):
+        date = parse_datetime(value) if value else None
+        if date is None:
+            raise BadRow(f'плохая дата {value!r}')
+        return date
+
+    def add(self, row):
+        kind = row.get('type')
+        if kind not in self.pending:
+            raise BadRow(f'неизвестный тип строки {kind!r}')
+        self.pending[kind].append(row)
+        if len(self.pending[kind]) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        # пачки пишутся в порядке зависимостей: пост не раньше своего автора
+        for kind in ORDER:
+            rows, self.pending[kind] = self.pending[kind], []
+            if not rows:
+                continue
+            try:
+                with transaction.atomic():
+                    written = getattr(self, f'_write_{kind}s')(rows)
+            except IntegrityError as error:
+                # пачка откатилась целиком; записанные раньше пачки остаются
+                raise BadRow(f'пачка строк {kind} не записана: {error}')
+            self.counts[kind] += written
+            self.counts['skipped'] += len(rows) - written
+
+    def _write_users(self, rows):
+        total = len(rows)
+        rows = [row for row in rows if row['username'] not in self.users]
+        User.objects.bulk_create(
+            User(
+                username=row['username'],
+                email=row.get('email', ''),
+                first_name=row.get('first_name', ''),
+                last_name=row.get('last_name', ''),
+                # пароль переносится уже захешированным, иначе вход только через сброс
+                password=row.get('password') or make_password(None),
+                date_joined=self._date(row['date_joined']) if row.get('date_joined') else timezone.now(),
+            )
+            for row in rows
+        )
+        # SQLite не возвращает id из bulk_create — дочитываем их одним запросом
+        created = dict(User.objects.filter(
+            username__in=[row['username'] for row in rows]
+        ).values_list('username', 'pk'))
+        self.users.update(created)
+        self.counted.update(created.values())
+        return total
+
+    def _write_groups(self, rows):
+        total = len(rows)
+        rows = [row for row in rows if row['slug'] not in self.groups]
+        Group.objects.bulk_create(
+            Group(slug=row['slug'], title=row['title'], description=row.get('description', ''))
+            for row in rows
+        )
+        self.groups.update(Group.objects.filter(
+            slug__in=[row['slug'] for row in rows]
+        ).values_list('slug', 'pk'))
+        return total
+
+    def _write_posts(self, rows):
+        posts = []
+        for row in rows:
+            group_id = None
+            if row.get('group'):
+                try:
+                    group_id = self.groups[row['group']]
+                except KeyError:
+                    raise BadRow(f'неизвестная группа {row["group"]!r}')
+                self.groups_changed.add(group_id)
+            posts.append(Post(
+                author_id=self._user_id(row['author']),
+                group_id=group_id,
+                text=row['text'],
+                pub_date=self._date(row['pub_date']),
+                image=row.get('image') or None,
+            ))
+        Post.objects.bulk_create(posts)
+        if connection.features.can_return_ids_from_bulk_insert:
+            ids = [post.pk for post in posts]
+        else:
+            # SQLite не возвращает id из bulk_create. Пачка пишется в одной
+            # транзакции, и после первой вставки других писателей в базу нет:
+            # наши посты — последние по id, в порядке вставки
+            ids = Post.objects.order_by('-pk').values_list('pk', flat=True)[:len(posts)]
+            ids = sorted(ids)
+        # комментарии поста, последнего в прошлой пачке, могут прийти в этой
+        self.posts = self.recent_posts
+        self.recent_posts = {row['id']: pk for row, pk in zip(rows, ids) if row.get('id') is not None}
+        self.posts.update(self.recent_posts)
+        search.index_posts(ids)
+        self.authors.update(post.author_id for post in posts)
+        return len(posts)
+
+    def _write_comments(self, rows):
+        # комментарии чужих постов из чужой выгрузки ссылаются на посты, которых
+        # в файле нет, — их некуда положить
+        comments = [
+            Comment(
+                post_id=self.posts[row['post']],
+                author_id=self._user_id(row['author']),
+                text=row['text'],
+                created=self._date(row['created']),
+            )
+            for row in rows if row['post'] in self.posts
+        ]
+        Comment.objects.bulk_create(comments)
+        counters.reconcile_comments({comment.post_id for comment in comments})
+        return len(comments)
+
+    def _write_follows(self, rows):
+        follows = [
+            Follow(user_id=self._user_id(row['user']), author_id=self._user_id(row['author']))
+            for row in rows
+        ]
+        Follow.objects.bulk_create(follows, ignore_conflicts=True)
+        self.authors.update(follow.author_id for follow in follows)
+        self.counted.update(follow.user_id for follow in follows)
+        return len(follows)
+
+    def run(self, lines):
+        """Загрузить строки JSONL (например, открытый файл)"""
+        return self.load(self._parse(lines))
+
+    @staticmethod
+    def _parse(lines):
+        for number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError as error:
+                raise BadRow(f'строка {number}: {error}')
+
+    def load(self, rows):
+        """Загрузить уже разобранные строки — словари того же вида"""
+        try:
+            with original_dates():
+                for number, row in enumerate(rows, 1):
+                    try:
+                        self.add(row)
+                    except (KeyError, BadRow) as error:
+                        raise BadRow(f'строка {number}: {error}')
+                self.flush()
+        finally:
+            # записанные до ошибки пачки не должны остаться без счётчиков и лент
+            if any(self.counts.values()):
+                self.rebuild()
+        return self.counts
+
+    def rebuild(self):
+        """Пересчитать то, что в обычной работе поддерживают сигналы, для затронутых авторов"""
+        counters.reconcile(sorted(self.authors | self.counted))
+        # ленты подписок: после пересчёта подписчиков, от него зависит is_pulled
+        timeline.rebuild_authors(sorted(self.authors))
+        autocomplete.invalidate()
+        versions.bump('posts', *(f'author:{pk}' for pk in self.authors),
+                      *(f'group:{pk}' for pk in self.groups_changed))
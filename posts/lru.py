@@ -0,0 +1,30 @@
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Небольшой потокобезопасный кеш в памяти процесса с вытеснением давно не читанных ключей"""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                self.data.move_to_end(key)
+            except KeyError:
+                return default
+            return self.data[key]
+
+    def set(self, key, value):
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
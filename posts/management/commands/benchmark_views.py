@@ -0,0 +1,38 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import benchmark
+
+
+class Command(BaseCommand):
+    help = 'Замеряет задержку (p50/p95) и число SQL-запросов представлений posts на текущей базе, вывод — JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=20, help='замеров на маршрут')
+        parser.add_argument('--warmup', type=int, default=2, help='прогревочных запросов, в замер не входят')
+        parser.add_argument('--cold', action='store_true', help='очищать кеш перед каждым запросом')
+        parser.add_argument('--only', nargs='*', help='только эти маршруты')
+        parser.add_argument('-o', '--output', help='записать JSON в файл')
+        parser.add_argument('--compare', help='JSON прошлого прогона: найти регрессии')
+        parser.add_argument('--tolerance', type=float, default=0.2, help='допустимый рост p95, доля')
+
+    def handle(self, *args, **options):
+        if not benchmark.Post.objects.exists():
+            raise CommandError('База пуста: сначала заполните её, например командой seed_load')
+        report = benchmark.run(options['repeat'], options['warmup'], options['cold'], options['only'])
+        text = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as output:
+                output.write(text)
+        else:
+            self.stdout.write(text)
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as previous:
+                baseline = json.load(previous)
+            if baseline.get('config') != report['config'] or baseline.get('data') != report['data']:
+                self.stderr.write('Внимание: прошлый прогон был с другими настройками или данными')
+            regressions = benchmark.compare(report, baseline, options['tolerance'])
+            if regressions:
+                raise CommandError('Регрессии:\n' + '\n'.join(regressions))
+            self.stderr.write('Регрессий нет')
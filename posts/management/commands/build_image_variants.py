@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from posts import thumbnails
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Строит адаптивные варианты картинок для постов, у которых их ещё нет'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='перестроить варианты у всех постов с картинкой')
+
+    def handle(self, *args, **options):
+        posts = Post.objects.exclude(image='').exclude(image=None)
+        if not options['all']:
+            posts = posts.filter(image_variants='')
+        total = 0
+        for post_id, name in posts.values_list('pk', 'image').iterator():
+            try:
+                thumbnails.save_variants(post_id, name, thumbnails.build_variants(name))
+            except Exception as error:
+                self.stderr.write(f'{name}: {error}')
+                continue
+            total += 1
+        self.stdout.write(self.style.SUCCESS(f'Обработано картинок: {total}'))
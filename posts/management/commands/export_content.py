@@ -0,0 +1,28 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import export
+from posts.models import User
+
+
+class Command(BaseCommand):
+    help = 'Выгружает посты и комментарии пользователя в JSONL или ZIP с картинками'
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('--format', choices=('jsonl', 'zip'), default='jsonl')
+        parser.add_argument('-o', '--output', help='файл для выгрузки, иначе стандартный вывод')
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(username=options['username']).first()
+        if user is None:
+            raise CommandError(f'Пользователя {options["username"]} нет')
+        chunks = export.zip_archive(user) if options['format'] == 'zip' else export.jsonl(user)
+        output = open(options['output'], 'wb') if options['output'] else sys.stdout.buffer
+        try:
+            for chunk in chunks:
+                output.write(chunk)
+        finally:
+            if options['output']:
+                output.close()
@@ -0,0 +1,24 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import importer
+
+
+class Command(BaseCommand):
+    help = 'Загружает пользователей, группы, посты, комментарии и подписки из JSONL-файла'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='JSONL-файл, «-» — стандартный ввод')
+        parser.add_argument('--batch-size', type=int, default=importer.BATCH_SIZE,
+                            help='строк в одной пачке bulk_create и транзакции')
+
+    def handle(self, *args, **options):
+        source = sys.stdin if options['path'] == '-' else open(options['path'], encoding='utf-8')
+        try:
+            with source:
+                counts = importer.Importer(options['batch_size']).run(source)
+        except importer.BadRow as error:
+            raise CommandError(str(error))
+        for kind, total in counts.items():
+            self.stdout.write(self.style.SUCCESS(f'{kind}: {total}'))
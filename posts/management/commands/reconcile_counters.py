@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from posts import counters
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счётчики постов и подписок в UserStats и комментариев в Post'
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames', nargs='*', help='только для этих пользователей')
+
+    def handle(self, *args, **options):
+        user_ids = None
+        if options['usernames']:
+            user_ids = counters.User.objects.filter(
+                username__in=options['usernames']
+            ).values_list('pk', flat=True)
+        total = counters.reconcile(user_ids)
+        self.stdout.write(self.style.SUCCESS(f'Пересчитано пользователей: {total}'))
+        if user_ids is None:
+            total = counters.reconcile_comments()
+            self.stdout.write(self.style.SUCCESS(f'Пересчитано постов: {total}'))
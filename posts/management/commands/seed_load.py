@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+
+from posts import importer, seed
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Создаёт синтетических пользователей, группы, посты, комментарии и подписки для замеров'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--groups', type=int, default=20)
+        parser.add_argument('--posts', type=int, default=20000)
+        parser.add_argument('--comments', type=int, default=50000)
+        parser.add_argument('--follows', type=float, default=20, help='среднее число подписок у пользователя')
+        parser.add_argument('--seed', type=int, default=0, help='зерно генератора: одинаковое даёт одинаковые данные')
+        parser.add_argument('--prefix', default='load', help='начало логинов и слагов групп')
+
+    def handle(self, *args, **options):
+        first_post_id = (Post.objects.aggregate(last=Max('id'))['last'] or 0) + 1
+        rows = seed.rows(options['users'], options['groups'], options['posts'], options['comments'],
+                         options['follows'], first_post_id, seed=options['seed'], prefix=options['prefix'])
+        counts = importer.Importer().load(rows)
+        for kind, total in counts.items():
+            self.stdout.write(self.style.SUCCESS(f'{kind}: {total}'))
@@ -0,0 +1,41 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import slowlog
+
+
+class Command(BaseCommand):
+    help = 'Сводка журнала медленных запросов: худшие отпечатки запросов по суммарному времени'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--log', default=settings.SLOW_QUERY_LOG, help='файл журнала')
+        parser.add_argument('--top', type=int, default=10, help='сколько отпечатков показать')
+        parser.add_argument('--view', help='только запросы этого маршрута')
+        parser.add_argument('--json', action='store_true', help='вывести сводку в JSON')
+
+    def handle(self, *args, **options):
+        try:
+            entries = list(slowlog.read(options['log']))
+        except FileNotFoundError:
+            raise CommandError(f'Журнала {options["log"]} нет: медленных запросов ещё не было')
+        if options['view']:
+            entries = [entry for entry in entries if entry.get('view') == options['view']]
+        summary = slowlog.summarize(entries)[:options['top']]
+        if options['json']:
+            self.stdout.write(json.dumps(summary, ensure_ascii=False, indent=2))
+            return
+        self.stdout.write(f'Записей в журнале: {len(entries)}')
+        for group in summary:
+            views = ', '.join(f'{view} ×{count}' for view, count in
+                              sorted(group['views'].items(), key=lambda item: -item[1]))
+            self.stdout.write('')
+            self.stdout.write(self.style.WARNING(
+                f"{group['fingerprint']}  всего {group['total_ms']} мс, раз {group['count']}, "
+                f"в среднем {group['mean_ms']} мс, худший {group['max_ms']} мс"
+            ))
+            self.stdout.write(f'  маршруты: {views}')
+            self.stdout.write(f"  {group['sql']}")
+            for line in group['plan'] or ():
+                self.stdout.write(f'    план: {line}')
@@ -0,0 +1,268 @@
+"""
+Метрики запросов. Middleware считает для каждого запроса число SQL-запросов
+и время в базе (connection.execute_wrapper), время рендера шаблонов без
+ленивых запросов внутри них и попадания/промахи кеша, отдаёт это в заголовке
+Server-Timing и копит гистограммы по имени маршрута. Страница /metrics/
+показывает их персоналу в текстовом формате Prometheus. Медленные запросы
+та же обёртка передаёт в журнал posts/slowlog.py.
+
+Счётчики живут в памяти процесса, как и шина событий: при нескольких
+процессах сервера /metrics/ показывает счётчики ответившего процесса.
+Время потоковых ответов считается до начала потока.
+"""
+import bisect
+import contextlib
+import functools
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+from django.template.base import Template
+from django.urls import Resolver404, resolve
+
+from . import slowlog
+
+# границы корзин гистограмм, как принято в Prometheus: «не больше»
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+
+_local = threading.local()
+_lock = threading.Lock()
+_views = {}
+
+
+class RequestStats:
+    """Счётчики одного запроса; заодно обёртка для connection.execute_wrapper"""
+
+    def __init__(self, request=None):
+        self.request = request
+        self.queries = 0
+        self.sql = 0.0
+        self.templates = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.rendering = False
+        self.batch = False
+        self.explaining = False
+
+    def __call__(self, execute, sql, params, many, context):
+        if self.explaining:
+            # EXPLAIN для журнала медленных запросов не входит в счётчики
+            return execute(sql, params, many, context)
+        start = time.perf_counter()
+        try:
+            result = execute(sql, params, many, context)
+        finally:
+            seconds = time.perf_counter() - start
+            self.queries += 1
+            self.sql += seconds
+        slowlog.observe(self, sql, params, many, context, seconds)
+        return result
+
+
+def current():
+    """Счётчики запроса, который обрабатывает этот поток, или None"""
+    return getattr(_local, 'stats', None)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class ViewMetrics:
+    def __init__(self):
+        self.duration = Histogram(DURATION_BUCKETS)
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.sql = 0.0
+        self.templates = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.responses = {}
+
+
+def record(view, status, duration, stats):
+    with _lock:
+        metrics = _views.get(view)
+        if metrics is None:
+            metrics = _views[view] = ViewMetrics()
+        metrics.duration.observe(duration)
+        metrics.queries.observe(stats.queries)
+        metrics.sql += stats.sql
+        metrics.templates += stats.templates
+        metrics.hits += stats.hits
+        metrics.misses += stats.misses
+        code = f'{status // 100}xx'
+        metrics.responses[code] = metrics.responses.get(code, 0) + 1
+
+
+def reset():
+    with _lock:
+        _views.clear()
+
+
+def server_timing(stats, duration):
+    # значения заголовка должны быть в latin-1, поэтому описания по-английски
+    return ', '.join((
+        f'db;dur={stats.sql * 1000:.1f};desc="SQL x{stats.queries}"',
+        f'tpl;dur={stats.templates * 1000:.1f};desc="templates"',
+        f'cache;desc="hit {stats.hits}, miss {stats.misses}"',
+        f'total;dur={duration * 1000:.1f}',
+    ))
+
+
+def _view_name(request):
+    if request.resolver_match is not None:
+        return request.resolver_match.view_name
+    # ответ из кеша страниц отдаётся до разбора URL
+    try:
+        return resolve(request.path_info, getattr(request, 'urlconf', None)).view_name
+    except Resolver404:
+        return 'unresolved'
+
+
+class RequestMetricsMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = _local.stats = RequestStats(request)
+        start = time.perf_counter()
+        try:
+            with contextlib.ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(stats))
+                response = self.get_response(request)
+        finally:
+            _local.stats = None
+        duration = time.perf_counter() - start
+        record(_view_name(request), response.status_code, duration, stats)
+        response['Server-Timing'] = server_timing(stats, duration)
+        return response
+
+
+def _timed_render(render):
+    @functools.wraps(render)
+    def wrapper(self, context):
+        stats = current()
+        # include рендерит вложенные шаблоны, их время уже внутри внешнего
+        if stats is None or stats.rendering:
+            return render(self, context)
+        stats.rendering = True
+        start, sql = time.perf_counter(), stats.sql
+        try:
+            return render(self, context)
+        finally:
+            stats.rendering = False
+            # запросы ленивых QuerySet из шаблона уже учтены как SQL
+            stats.templates += time.perf_counter() - start - (stats.sql - sql)
+    return wrapper
+
+
+_MISSING = object()
+
+
+def _counted_get(get):
+    @functools.wraps(get)
+    def wrapper(self, key, default=None, version=None):
+        value = get(self, key, _MISSING, version=version)
+        stats = current()
+        if stats is not None and not stats.batch:
+            if value is _MISSING:
+                stats.misses += 1
+            else:
+                stats.hits += 1
+        return default if value is _MISSING else value
+    return wrapper
+
+
+def _counted_get_many(get_many):
+    @functools.wraps(get_many)
+    def wrapper(self, keys, version=None):
+        stats = current()
+        if stats is None or stats.batch:
+            return get_many(self, keys, version=version)
+        # get_many по умолчанию зовёт get на каждый ключ — их не считаем дважды
+        keys = list(keys)
+        stats.batch = True
+        try:
+            found = get_many(self, keys, version=version)
+        finally:
+            stats.batch = False
+        stats.hits += len(found)
+        stats.misses += len(keys) - len(found)
+        return found
+    return wrapper
+
+
+def install():
+    """Подключает замеры шаблонов и кешей; вызывается один раз из PostConfig.ready()"""
+    if not getattr(Template.render, 'metrics_installed', False):
+        Template.render = _timed_render(Template.render)
+        Template.render.metrics_installed = True
+    for alias in settings.CACHES:
+        backend = type(caches[alias])
+        if getattr(backend.get, 'metrics_installed', False):
+            continue
+        backend.get = _counted_get(backend.get)
+        backend.get_many = _counted_get_many(backend.get_many)
+        backend.get.metrics_installed = backend.get_many.metrics_installed = True
+
+
+def _labels(**labels):
+    escaped = (
+        (name, str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+        for name, value in labels.items()
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def _histogram(lines, name, view, histogram):
+    total = 0
+    for bound, count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+        total += count
+        lines.append(f'{name}_bucket{_labels(view=view, le=bound)} {total}')
+    lines.append(f'{name}_sum{_labels(view=view)} {histogram.sum}')
+    lines.append(f'{name}_count{_labels(view=view)} {histogram.count}')
+
+
+def exposition():
+    """Все метрики процесса в текстовом формате Prometheus"""
+    with _lock:
+        views = sorted(_views.items())
+        lines = []
+        lines += ['# HELP yatube_requests_total Ответы по маршрутам и классам статуса',
+                  '# TYPE yatube_requests_total counter']
+        for view, metrics in views:
+            for code, count in sorted(metrics.responses.items()):
+                lines.append(f'yatube_requests_total{_labels(view=view, status=code)} {count}')
+        lines += ['# HELP yatube_request_duration_seconds Время ответа',
+                  '# TYPE yatube_request_duration_seconds histogram']
+        for view, metrics in views:
+            _histogram(lines, 'yatube_request_duration_seconds', view, metrics.duration)
+        lines += ['# HELP yatube_request_queries SQL-запросов на один ответ',
+                  '# TYPE yatube_request_queries histogram']
+        for view, metrics in views:
+            _histogram(lines, 'yatube_request_queries', view, metrics.queries)
+        lines += ['# HELP yatube_sql_seconds_total Время в SQL-запросах',
+                  '# TYPE yatube_sql_seconds_total counter']
+        lines += [f'yatube_sql_seconds_total{_labels(view=view)} {m.sql}' for view, m in views]
+        lines += ['# HELP yatube_template_seconds_total Время рендера шаблонов без SQL',
+                  '# TYPE yatube_template_seconds_total counter']
+        lines += [f'yatube_template_seconds_total{_labels(view=view)} {m.templates}' for view, m in views]
+        lines += ['# HELP yatube_cache_requests_total Чтения ключей кеша',
+                  '# TYPE yatube_cache_requests_total counter']
+        for view, metrics in views:
+            lines.append(f'yatube_cache_requests_total{_labels(view=view, result="hit")} {metrics.hits}')
+            lines.append(f'yatube_cache_requests_total{_labels(view=view, result="miss")} {metrics.misses}')
+    return '\n'.join(lines) + '\n'
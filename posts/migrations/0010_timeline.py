@@ -0,0 +1,68 @@
+# Generated by Django 2.2.9 on 2026-10-17 03:54
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_timeline(apps, schema_editor):
+    Follow = apps.get_model('posts', 'Follow')
+    Post = apps.get_model('posts', 'Post')
+    Timeline = apps.get_model('posts', 'Timeline')
+    for user_id, author_id in Follow.objects.values_list('user_id', 'author_id').distinct().iterator():
+        posts = Post.objects.filter(author_id=author_id).order_by('-pub_date').values_list('pk', 'pub_date')
+        Timeline.objects.bulk_create(
+            (Timeline(user_id=user_id, post_id=pk, pub_date=pub_date)
+             for pk, pub_date in posts[:settings.TIMELINE_BACKFILL_LIMIT]),
+            batch_size=500,
+            ignore_conflicts=True,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('posts', '0009_auto_20200825_1144'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='comment',
+            name='text',
+            field=models.TextField(verbose_name='Текст комментария'),
+        ),
+        migrations.AlterField(
+            model_name='group',
+            name='title',
+            field=models.CharField(max_length=200, verbose_name='Группа'),
+        ),
+        migrations.AlterField(
+            model_name='post',
+            name='image',
+            field=models.ImageField(blank=True, null=True, upload_to='posts/', verbose_name='Картинка'),
+        ),
+        migrations.AlterField(
+            model_name='post',
+            name='text',
+            field=models.TextField(verbose_name='Текст публикации'),
+        ),
+        migrations.CreateModel(
+            name='Timeline',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pub_date', models.DateTimeField()),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline', to='posts.Post')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='timeline',
+            index=models.Index(fields=['user', '-pub_date', '-post'], name='posts_timeline_feed_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='timeline',
+            unique_together={('user', 'post')},
+        ),
+        migrations.RunPython(fill_timeline, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 2.2.9 on 2026-10-17 03:58
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+import django.db.models.deletion
+
+
+def fill_stats(apps, schema_editor):
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+    Post = apps.get_model('posts', 'Post')
+    Follow = apps.get_model('posts', 'Follow')
+    UserStats = apps.get_model('posts', 'UserStats')
+
+    def counts(queryset, field):
+        return dict(queryset.values_list(field).annotate(n=Count('pk')).order_by())
+
+    posts = counts(Post.objects, 'author_id')
+    followers = counts(Follow.objects, 'author_id')
+    following = counts(Follow.objects, 'user_id')
+    UserStats.objects.bulk_create(
+        (UserStats(user_id=pk,
+                   posts_count=posts.get(pk, 0),
+                   followers_count=followers.get(pk, 0),
+                   following_count=following.get(pk, 0))
+         for pk in User.objects.values_list('pk', flat=True).iterator()),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0011_update_proxy_permissions'),
+        ('posts', '0010_timeline'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('posts_count', models.PositiveIntegerField(default=0, verbose_name='Записей')),
+                ('followers_count', models.PositiveIntegerField(db_index=True, default=0, verbose_name='Подписчиков')),
+                ('following_count', models.PositiveIntegerField(default=0, verbose_name='Подписан')),
+            ],
+        ),
+        migrations.RunPython(fill_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 2.2.9 on 2026-10-17 03:59
+
+from django.db import migrations, models
+from django.db.models import Count
+
+BATCH_SIZE = 1000
+
+
+def fill_comment_count(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    Comment = apps.get_model('posts', 'Comment')
+    last_pk = 0
+    while True:
+        batch = list(Post.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:BATCH_SIZE])
+        if not batch:
+            return
+        counts = dict(
+            Comment.objects.filter(post_id__in=batch).values_list('post_id').annotate(n=Count('pk')).order_by()
+        )
+        Post.objects.bulk_update(
+            [Post(pk=pk, comment_count=counts[pk]) for pk in batch if pk in counts], ['comment_count']
+        )
+        last_pk = batch[-1]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0011_userstats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='comment_count',
+            field=models.PositiveIntegerField(db_index=True, default=0, verbose_name='Комментариев'),
+        ),
+        migrations.RunPython(fill_comment_count, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 2.2.9 on 2026-10-17 05:12
+
+from django.db import migrations
+
+
+def create_fts(apps, schema_editor):
+    # FTS5 есть только в SQLite; на других СУБД поиск отключён
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS posts_post_fts "
+        "USING fts5(text, tokenize='unicode61 remove_diacritics 2')"
+    )
+    schema_editor.execute('INSERT INTO posts_post_fts(rowid, text) SELECT id, text FROM posts_post')
+
+
+def drop_fts(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS posts_post_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0012_post_comment_count'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts, drop_fts),
+    ]
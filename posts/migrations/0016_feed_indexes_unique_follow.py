@@ -0,0 +1,50 @@
+# Generated by Django 2.2.9 on 2026-10-17 04:47
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def dedupe_follows(apps, schema_editor):
+    # до уникального ограничения повторная подписка могла проскочить в гонке
+    Follow = apps.get_model('posts', 'Follow')
+    UserStats = apps.get_model('posts', 'UserStats')
+    duplicates = Follow.objects.values('user_id', 'author_id').annotate(
+        first=Min('id'), rows=Count('id')
+    ).filter(rows__gt=1)
+    users = set()
+    for row in duplicates:
+        Follow.objects.filter(user_id=row['user_id'], author_id=row['author_id']).exclude(pk=row['first']).delete()
+        users.update((row['user_id'], row['author_id']))
+    # счётчики подписок учитывали и повторные строки
+    for user_id in users:
+        UserStats.objects.filter(user_id=user_id).update(
+            followers_count=Follow.objects.filter(author_id=user_id).count(),
+            following_count=Follow.objects.filter(user_id=user_id).count(),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0015_post_image_storage'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe_follows, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'created', 'id'], name='posts_comment_post_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['author', '-pub_date', '-id'], name='posts_post_author_feed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['group', '-pub_date', '-id'], name='posts_post_group_feed_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='follow',
+            constraint=models.UniqueConstraint(fields=('user', 'author'), name='posts_follow_unique'),
+        ),
+    ]
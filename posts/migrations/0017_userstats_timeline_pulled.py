@@ -0,0 +1,18 @@
+# Generated by Django 2.2.9 on 2026-10-17 04:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0016_feed_indexes_unique_follow'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userstats',
+            name='timeline_pulled',
+            field=models.BooleanField(default=False, verbose_name='Лента при чтении'),
+        ),
+    ]
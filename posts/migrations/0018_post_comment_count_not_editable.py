@@ -0,0 +1,18 @@
+# Generated by Django 2.2.9 on 2026-10-17 05:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0017_userstats_timeline_pulled'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='post',
+            name='comment_count',
+            field=models.PositiveIntegerField(db_index=True, default=0, editable=False, verbose_name='Комментариев'),
+        ),
+    ]
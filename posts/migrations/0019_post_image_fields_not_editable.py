@@ -0,0 +1,33 @@
+# Generated by Django 2.2.9 on 2026-10-17 05:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0018_post_comment_count_not_editable'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='post',
+            name='image_height',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True, verbose_name='Высота картинки'),
+        ),
+        migrations.AlterField(
+            model_name='post',
+            name='image_placeholder',
+            field=models.TextField(blank=True, default='', editable=False, verbose_name='Заглушка картинки'),
+        ),
+        migrations.AlterField(
+            model_name='post',
+            name='image_variants',
+            field=models.TextField(blank=True, default='', editable=False, verbose_name='Варианты картинки'),
+        ),
+        migrations.AlterField(
+            model_name='post',
+            name='image_width',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True, verbose_name='Ширина картинки'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.db import migrations
+
+
+def mark_pulled_authors(apps, schema_editor):
+    # авторы, которые уже были популярны до появления флага, тоже читаются
+    # при чтении: их посты не раскладывались по лентам подписчиков
+    UserStats = apps.get_model('posts', 'UserStats')
+    UserStats.objects.filter(
+        followers_count__gt=settings.TIMELINE_FANOUT_MAX_FOLLOWERS
+    ).update(timeline_pulled=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0019_post_image_fields_not_editable'),
+    ]
+
+    operations = [
+        migrations.RunPython(mark_pulled_authors, migrations.RunPython.noop),
+    ]
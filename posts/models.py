@@ -1,4 +1,9 @@
-from django.db import models
+import json
+
+from django.db import models, transaction
+from django.utils.functional import cached_property
+
+from .storage import ContentAddressedStorage
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
@@ -13,15 +18,70 @@ class Group(models.Model):
         return self.title
 
 
+class PostQuerySet(models.QuerySet):
+    def feed(self):
+        # всё, что нужно карточке поста, одним запросом: автор и группа
+        return self.select_related('author', 'group')
+
+
 class Post(models.Model):
     text = models.TextField(verbose_name='Текст публикации')
     pub_date = models.DateTimeField(verbose_name="Дата публикации", auto_now_add=True, db_index=True)
     author = models.ForeignKey(User, on_delete=models.CASCADE, related_name="posts")
     group = models.ForeignKey(Group, on_delete=models.SET_NULL, blank=True, null=True, related_name="posts")
-    image = models.ImageField(verbose_name='Картинка', upload_to='posts/', blank=True, null=True)
+    image = models.ImageField(verbose_name='Картинка', upload_to='posts/', storage=ContentAddressedStorage(),
+                              blank=True, null=True)
+    # меняется только приращением в сигналах Comment, см. save()
+    comment_count = models.PositiveIntegerField(verbose_name='Комментариев', default=0, db_index=True,
+                                                editable=False)
+    # размеры и варианты картинки заполняет пул миниатюр (posts/thumbnails.py),
+    # чтобы карточке поста не нужны были ни файлы, ни KVStore; при замене
+    # картинки их сбрасывает сигнал pre_save (posts/signals.py)
+    image_width = models.PositiveIntegerField(verbose_name='Ширина картинки', blank=True, null=True,
+                                              editable=False)
+    image_height = models.PositiveIntegerField(verbose_name='Высота картинки', blank=True, null=True,
+                                               editable=False)
+    image_placeholder = models.TextField(verbose_name='Заглушка картинки', blank=True, default='',
+                                         editable=False)
+    image_variants = models.TextField(verbose_name='Варианты картинки', blank=True, default='',
+                                      editable=False)
+
+    objects = PostQuerySet.as_manager()
 
     class Meta:
         ordering = ("-pub_date",)
+        # ленты автора и группы: фильтр и сортировка курсора по одному индексу
+        indexes = [
+            models.Index(fields=["author", "-pub_date", "-id"], name="posts_post_author_feed_idx"),
+            models.Index(fields=["group", "-pub_date", "-id"], name="posts_post_group_feed_idx"),
+        ]
+
+    @cached_property
+    def variants(self):
+        """Список вариантов картинки {url, width, height} по возрастанию ширины"""
+        return json.loads(self.image_variants) if self.image_variants else []
+
+    @property
+    def image_srcset(self):
+        return ', '.join(f"{variant['url']} {variant['width']}w" for variant in self.variants)
+
+    def reset_image_variants(self):
+        self.image_width = self.image_height = None
+        self.image_placeholder = self.image_variants = ''
+        self.__dict__.pop('variants', None)
+
+    def save(self, *args, **kwargs):
+        # правка загруженного поста не пишет comment_count: иначе она вернула
+        # бы значение, прочитанное до комментария, добавленного тем временем
+        if not self._state.adding and not args and kwargs.get('update_fields') is None \
+                and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'comment_count'
+            ]
+        # счётчики и ленты обновляются в сигналах — в той же транзакции, что и пост
+        with transaction.atomic():
+            super().save(*args, **kwargs)
 
 
 class Comment(models.Model):
@@ -30,7 +90,42 @@ class Comment(models.Model):
     text = models.TextField(verbose_name='Текст комментария')
     created = models.DateTimeField("date created", auto_now_add=True)
 
+    class Meta:
+        indexes = [models.Index(fields=["post", "created", "id"], name="posts_comment_post_idx")]
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
 
 class Follow(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="follower")
     author = models.ForeignKey(User, on_delete=models.CASCADE, related_name="following")
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=["user", "author"], name="posts_follow_unique")]
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+
+class UserStats(models.Model):
+    """Счётчики для карточки автора, поддерживаются сигналами Post и Follow"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name="stats")
+    posts_count = models.PositiveIntegerField(verbose_name="Записей", default=0)
+    followers_count = models.PositiveIntegerField(verbose_name="Подписчиков", default=0, db_index=True)
+    following_count = models.PositiveIntegerField(verbose_name="Подписан", default=0)
+    # посты автора хоть раз не разложились по лентам (posts/timeline.py)
+    timeline_pulled = models.BooleanField(verbose_name="Лента при чтении", default=False)
+
+
+class Timeline(models.Model):
+    """Лента подписок, разложенная по получателям при публикации поста"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="timeline")
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name="timeline")
+    pub_date = models.DateTimeField()
+
+    class Meta:
+        unique_together = ("user", "post")
+        indexes = [models.Index(fields=["user", "-pub_date", "-post"], name="posts_timeline_feed_idx")]
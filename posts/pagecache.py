@@ -0,0 +1,49 @@
+"""
+Кеш целых страниц для анонимных читателей. Представление помечает ответ
+суррогатными ключами (post:1, author:2, group:3, posts, stats:2) через tag();
+запись в кеш хранит версии этих ключей на момент начала рендера. Сброс по
+ключу — это versions.bump(), его делают сигналы Post, Comment, Follow, Group
+и User, так что правки из представлений и из админки сбрасывают страницы
+одинаково и без гонок.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import versions
+
+
+def tag(request, *keys):
+    # версии снимаются до запросов к базе: если данные поменяются во время
+    # рендера, сохранённая страница уже будет считаться устаревшей
+    request.surrogate_keys = versions.get_many(keys)
+
+
+def _page_key(request):
+    url = f'{request.get_host()}{request.get_full_path()}'
+    return 'page:' + hashlib.md5(url.encode()).hexdigest()
+
+
+class AnonymousPageCacheMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if request.method not in ('GET', 'HEAD') or request.user.is_authenticated:
+            return self.get_response(request)
+
+        key = _page_key(request)
+        cached = cache.get(key)
+        if cached is not None:
+            response, keys = cached
+            if versions.get_many(keys) == keys:
+                return response
+
+        response = self.get_response(request)
+        keys = getattr(request, 'surrogate_keys', None)
+        personal = response.cookies or request.META.get('CSRF_COOKIE_USED')
+        if keys and response.status_code == 200 and not response.streaming and not personal:
+            response['Surrogate-Key'] = ' '.join(sorted(keys))
+            cache.set(key, (response, keys), settings.PAGE_CACHE_TIMEOUT)
+        return response
@@ -0,0 +1,194 @@
+import base64
+import binascii
+import collections.abc
+import datetime
+import heapq
+import itertools
+import json
+from operator import itemgetter
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def _encode_value(value):
+    # DjangoJSONEncoder обрезает микросекунды, а для курсора нужна точная дата
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} не может быть частью курсора')
+
+
+def encode_cursor(values):
+    raw = json.dumps(list(values), default=_encode_value, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        values = json.loads(raw.decode())
+        if not isinstance(values, list):
+            raise InvalidCursor(token)
+        # даты приходят строками в ISO-формате, возвращаем им тип datetime
+        return [parse_datetime(v) or v if isinstance(v, str) else v for v in values]
+    except (binascii.Error, ValueError, UnicodeDecodeError):
+        raise InvalidCursor(token)
+
+
+class CursorPaginator:
+    """
+    Постраничный вывод по ключу (keyset): вместо LIMIT/OFFSET и COUNT(*)
+    следующая страница выбирается условием «строго после последней записи»,
+    поэтому стоимость запроса не зависит от глубины страницы.
+    """
+
+    def __init__(self, object_list, per_page, ordering=('-pub_date', '-pk'), transform=None, streams=()):
+        self.object_list = object_list
+        # transform превращает выбранные строки в записи страницы,
+        # например строки ленты подписок в посты; курсор берётся из строк
+        self.transform = transform
+        # streams — другие CursorPaginator с тем же смыслом ключа, их строки
+        # сливаются с основными (k-way merge уже отсортированных потоков)
+        self.streams = list(streams)
+        self.per_page = int(per_page)
+        self.ordering = tuple(ordering)
+        self.fields = tuple(name.lstrip('-') for name in self.ordering)
+        self.descending = self.ordering[0].startswith('-')
+
+    def key(self, item):
+        if isinstance(item, dict):
+            return tuple(item[name] for name in self.fields)
+        return tuple(getattr(item, name) for name in self.fields)
+
+    def _seek(self, values, forward):
+        # (a, b) < (x, y)  <=>  a <= x AND (a < x OR b < y);
+        # первое условие даёт диапазон по индексу, поэтому OR не мешает плану
+        lookup = 'lt' if forward == self.descending else 'gt'
+        condition = Q(**{f'{self.fields[-1]}__{lookup}': values[-1]})
+        for name, value in zip(self.fields[-2::-1], values[-2::-1]):
+            condition = Q(**{f'{name}__{lookup}': value}) | (Q(**{name: value}) & condition)
+        return Q(**{f'{self.fields[0]}__{lookup}e': values[0]}) & condition
+
+    def _fetch(self, values, forward, limit):
+        """Возвращает до limit пар (ключ, запись) в порядке обхода страницы."""
+        pairs = self._fetch_own(values, forward, limit)
+        if not self.streams:
+            return pairs
+        merged = heapq.merge(
+            pairs,
+            *(stream._fetch(values, forward, limit) for stream in self.streams),
+            key=itemgetter(0),
+            reverse=forward == self.descending,
+        )
+        # один и тот же пост может прийти из двух потоков: ключи у них равны
+        unique = (next(group) for _, group in itertools.groupby(merged, key=itemgetter(0)))
+        return list(itertools.islice(unique, limit))
+
+    def _fetch_own(self, values, forward, limit):
+        queryset = self.object_list
+        if values is not None:
+            if len(values) != len(self.fields):
+                raise InvalidCursor(values)
+            try:
+                queryset = queryset.filter(self._seek(values, forward))
+            except (ValidationError, ValueError, TypeError):
+                raise InvalidCursor(values)
+        if forward:
+            ordering = self.ordering
+        else:
+            ordering = tuple(
+                name[1:] if name.startswith('-') else f'-{name}' for name in self.ordering
+            )
+        rows = list(queryset.order_by(*ordering)[:limit])
+        keys = [self.key(row) for row in rows]
+        if self.transform is not None:
+            rows = self.transform(rows)
+        return list(zip(keys, rows))
+
+    def get_page(self, after=None, before=None):
+        """
+        Возвращает страницу после курсора `after` или перед курсором `before`.
+        Испорченный курсор, как и в Paginator.get_page, даёт первую страницу.
+        """
+        try:
+            if before:
+                return CursorPage(self, decode_cursor(before), forward=False)
+            if after:
+                return CursorPage(self, decode_cursor(after), forward=True)
+        except InvalidCursor:
+            pass
+        return CursorPage(self, None, forward=True)
+
+
+class CursorPage(collections.abc.Sequence):
+    """
+    Страница курсорного паджинатора. Запрос выполняется лениво, при первом
+    обращении к записям, так что закешированный фрагмент шаблона его не делает.
+    """
+
+    def __init__(self, paginator, cursor, forward):
+        self.paginator = paginator
+        self.cursor = cursor
+        self.forward = forward
+
+    def __repr__(self):
+        direction = 'after' if self.forward else 'before'
+        return f'<CursorPage {direction}={self.cursor}>'
+
+    @cached_property
+    def _state(self):
+        paginator = self.paginator
+        try:
+            pairs = paginator._fetch(self.cursor, self.forward, paginator.per_page + 1)
+        except InvalidCursor:
+            pairs, self.cursor, self.forward = [], None, True
+        more = len(pairs) > paginator.per_page
+        pairs = pairs[:paginator.per_page]
+        if self.forward:
+            has_previous, has_next = self.cursor is not None, more
+        else:
+            pairs.reverse()
+            has_previous, has_next = more, True
+            if not more:
+                # дошли до начала ленты: показываем полную первую страницу
+                first = paginator.get_page()
+                return first._state
+        keys = (pairs[0][0], pairs[-1][0]) if pairs else (None, None)
+        return [item for _, item in pairs], has_previous, has_next, keys
+
+    @property
+    def object_list(self):
+        return self._state[0]
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self._state[2]
+
+    def has_previous(self):
+        return self._state[1]
+
+    def has_other_pages(self):
+        return self.has_previous() or self.has_next()
+
+    def next_cursor(self):
+        last = self._state[3][1]
+        if not self.has_next() or last is None:
+            return None
+        return encode_cursor(last)
+
+    def previous_cursor(self):
+        first = self._state[3][0]
+        if not self.has_previous() or first is None:
+            return None
+        return encode_cursor(first)
@@ -0,0 +1,113 @@
+"""
+Полнотекстовый поиск по Post.text на SQLite FTS5. Индекс — отдельная
+таблица posts_post_fts с rowid = id поста; её держат в актуальном состоянии
+сигналы Post (триггеры не годятся: SQLite-миграции пересоздают posts_post
+и теряют их). На других СУБД поиск просто недоступен.
+"""
+import re
+
+from django.db import connection
+from django.db.models.expressions import RawSQL
+
+from .models import Post
+from .paginator import CursorPaginator, InvalidCursor
+
+TABLE = 'posts_post_fts'
+WORD = re.compile(r'\w+')
+
+
+def available():
+    return connection.vendor == 'sqlite'
+
+
+def rebuild():
+    if not available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {TABLE}')
+        cursor.execute(f'INSERT INTO {TABLE}(rowid, text) SELECT id, text FROM posts_post')
+
+
+def index_posts(post_ids):
+    """Проиндексировать посты разом, например пачку массовой загрузки"""
+    if not available() or not post_ids:
+        return
+    post_ids = list(post_ids)
+    with connection.cursor() as cursor:
+        # кусками: у SQLite предел числа параметров в запросе
+        for start in range(0, len(post_ids), 500):
+            chunk = post_ids[start:start + 500]
+            marks = ', '.join(['%s'] * len(chunk))
+            cursor.execute(f'DELETE FROM {TABLE} WHERE rowid IN ({marks})', chunk)
+            cursor.execute(f'INSERT INTO {TABLE}(rowid, text) SELECT id, text FROM posts_post WHERE id IN ({marks})',
+                           chunk)
+
+
+def index_post(post_id, text):
+    if not available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {TABLE} WHERE rowid = %s', [post_id])
+        cursor.execute(f'INSERT INTO {TABLE}(rowid, text) VALUES (%s, %s)', [post_id, text])
+
+
+def unindex_post(post_id):
+    if not available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {TABLE} WHERE rowid = %s', [post_id])
+
+
+def to_match(query):
+    # пользовательский ввод не должен попадать в синтаксис FTS5 как есть:
+    # каждое слово берём в кавычки, последнее ищем ещё и как префикс
+    words = WORD.findall(query)
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def matching_ids(query):
+    """Подзапрос id постов, подходящих под запрос, для фильтра pk__in."""
+    return RawSQL(f'SELECT rowid FROM {TABLE} WHERE {TABLE} MATCH %s', [to_match(query)])
+
+
+def ranked_ids(query, offset, limit):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT rowid FROM {TABLE} WHERE {TABLE} MATCH %s ORDER BY rank LIMIT %s OFFSET %s',
+            [to_match(query), limit, offset],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+class SearchPaginator(CursorPaginator):
+    """
+    Результаты поиска по релевантности. Ключ записи — её позиция в выдаче,
+    поэтому страницы и шаблон паджинатора те же, что у лент.
+    """
+
+    def __init__(self, query, per_page):
+        super().__init__(Post.objects.none(), per_page, ordering=('position',))
+        self.query = query
+
+    def _fetch_own(self, values, forward, limit):
+        # без FTS5 поиск пуст, как пусты и записи в индекс
+        if not available() or not to_match(self.query):
+            return []
+        if values is None:
+            start, count = 0, limit
+        else:
+            if len(values) != 1 or not isinstance(values[0], int) or values[0] < 0:
+                raise InvalidCursor(values)
+            if forward:
+                start, count = values[0] + 1, limit
+            else:
+                start = max(values[0] - limit, 0)
+                count = values[0] - start
+        ids = ranked_ids(self.query, start, count) if count else []
+        posts = Post.objects.feed().in_bulk(ids)
+        pairs = [((start + i,), posts[pk]) for i, pk in enumerate(ids) if pk in posts]
+        return pairs if forward else pairs[::-1]
@@ -0,0 +1,82 @@
+"""
+Синтетические данные для нагрузочных замеров. Активность и популярность
+распределены по степенному закону: несколько авторов пишут много и
+собирают большую часть подписчиков, у большинства — единицы. Строки
+генерируются в формате import_content и пишутся тем же Importer.
+"""
+import bisect
+import collections
+import datetime
+import itertools
+import random
+
+from django.utils import timezone
+
+WORDS = ('день', 'город', 'кот', 'дом', 'море', 'книга', 'музыка', 'друг', 'дорога', 'утро', 'вечер',
+         'работа', 'кофе', 'лес', 'снег', 'солнце', 'поезд', 'фото', 'река', 'письмо')
+
+
+class PowerLaw:
+    """Выбор индекса 0..n-1 с весом 1 / (i + 1) ** exponent"""
+
+    def __init__(self, n, exponent, rng):
+        self.rng = rng
+        self.cumulative = list(itertools.accumulate(1 / (i + 1) ** exponent for i in range(n)))
+
+    def __call__(self):
+        return bisect.bisect(self.cumulative, self.rng.random() * self.cumulative[-1])
+
+
+def rows(users, groups, posts, comments, follows, first_post_id, seed=0, prefix='load'):
+    """
+    Строки для Importer.load. follows — среднее число подписок на
+    пользователя; посты получают id подряд с first_post_id, по ним на
+    посты ссылаются комментарии, идущие сразу за своим постом.
+    """
+    rng = random.Random(seed)
+    now = timezone.now()
+    usernames = [f'{prefix}{i}' for i in range(users)]
+    slugs = [f'{prefix}-group-{i}' for i in range(groups)]
+
+    for username in usernames:
+        yield {'type': 'user', 'username': username, 'first_name': rng.choice(WORDS).title()}
+    for i, slug in enumerate(slugs):
+        yield {'type': 'group', 'slug': slug, 'title': f'Группа {i}', 'description': ''}
+
+    author = PowerLaw(users, 1.1, rng)
+    group = PowerLaw(groups, 1.0, rng) if groups else None
+
+    # на кого подписываются — тоже степенной закон, поэтому и подписчики у авторов распределены так же
+    for i, username in enumerate(usernames):
+        wanted = min(int(rng.expovariate(1 / follows)) if follows else 0, users - 1)
+        chosen = set()
+        for _ in range(wanted * 3):
+            if len(chosen) >= wanted:
+                break
+            target = author()
+            if target != i:
+                chosen.add(target)
+        for target in sorted(chosen):
+            yield {'type': 'follow', 'user': username, 'author': usernames[target]}
+
+    # комментарии тоже скапливаются: у немногих постов их много. Importer
+    # ждёт их сразу за постом, поэтому число комментариев поста считается заранее
+    post = PowerLaw(posts, 1.0, rng) if posts else None
+    per_post = collections.Counter(post() for _ in range(comments if posts else 0))
+    for i in range(posts):
+        yield {
+            'type': 'post',
+            'id': first_post_id + i,
+            'author': usernames[author()],
+            'group': slugs[group()] if group and rng.random() < 0.6 else None,
+            'text': ' '.join(rng.choice(WORDS) for _ in range(rng.randint(5, 60))),
+            'pub_date': (now - datetime.timedelta(seconds=rng.randint(0, 365 * 24 * 3600))).isoformat(),
+        }
+        for _ in range(per_post[i]):
+            yield {
+                'type': 'comment',
+                'post': first_post_id + i,
+                'author': usernames[author()],
+                'text': ' '.join(rng.choice(WORDS) for _ in range(rng.randint(2, 20))),
+                'created': now.isoformat(),
+            }
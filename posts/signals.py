@@ -0,0 +1,118 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import counters, events, search, thumbnails, timeline, versions
+from .models import Comment, Follow, Group, Post, User, UserStats
+
+
+# поля пользователя, которые видны на страницах
+NAME_FIELDS = ('username', 'first_name', 'last_name')
+
+
+@receiver(pre_save, sender=User)
+def user_changing(sender, instance, update_fields, **kwargs):
+    # вход, смена пароля или почты, права в админке на страницах не видны
+    instance._names_changed = False
+    if instance.pk is None or (update_fields is not None and not set(NAME_FIELDS) & set(update_fields)):
+        return
+    old = User.objects.filter(pk=instance.pk).values_list(*NAME_FIELDS).first()
+    instance._names_changed = old is not None and old != tuple(getattr(instance, name) for name in NAME_FIELDS)
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, **kwargs):
+    if created:
+        # у нового пользователя ещё нет ни постов, ни комментариев
+        UserStats.objects.get_or_create(user=instance)
+    elif instance._names_changed:
+        # имена пользователей выводятся на любых страницах: в карточках,
+        # комментариях, шапке профиля — отсюда общая область names
+        versions.bump('posts', f'author:{instance.pk}', 'names')
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def group_changed(sender, instance, **kwargs):
+    versions.bump('posts', f'group:{instance.pk}', 'names')
+
+
+@receiver(pre_save, sender=Post)
+def post_changing(sender, instance, **kwargs):
+    if instance.pk is None:
+        instance._image_changed = bool(instance.image)
+        return
+    old = Post.objects.filter(pk=instance.pk).values('group_id', 'image', 'image_variants').first()
+    if old is None:
+        return
+    # пост могли перенести в другую группу: её лента тоже устарела
+    if old['group_id'] is not None and old['group_id'] != instance.group_id:
+        versions.bump(f'group:{old["group_id"]}')
+    # размеры и варианты старой картинки к новой не подходят, кто бы её ни
+    # заменил: форма, админка или код
+    instance._image_changed = (old['image'] or '') != (instance.image.name or '')
+    if instance._image_changed:
+        instance.reset_image_variants()
+    if old['image'] and instance._image_changed:
+        variants = Post(image_variants=old['image_variants']).variants
+        thumbnails.release_image(old['image'], variants)
+
+
+@receiver(post_save, sender=Post)
+def post_published(sender, instance, created, update_fields, **kwargs):
+    versions.bump(*versions.post_scopes(instance.pk, instance.author_id, instance.group_id))
+    if update_fields is None or 'text' in update_fields:
+        search.index_post(instance.pk, instance.text)
+    if getattr(instance, '_image_changed', False):
+        instance._image_changed = False
+        thumbnails.schedule(instance.image)
+        thumbnails.schedule_variants(instance)
+    if created:
+        counters.bump(instance.author_id, posts_count=1)
+        timeline.fan_out(instance)
+        event = events.post_event(instance)
+        transaction.on_commit(lambda: events.publish(event))
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    versions.bump(*versions.post_scopes(instance.pk, instance.author_id, instance.group_id))
+    search.unindex_post(instance.pk)
+    if instance.image:
+        thumbnails.release_image(instance.image.name, instance.variants)
+    counters.bump(instance.author_id, posts_count=-1)
+
+
+@receiver(post_save, sender=Follow)
+def follow_created(sender, instance, created, **kwargs):
+    if created:
+        counters.bump(instance.author_id, followers_count=1)
+        counters.bump(instance.user_id, following_count=1)
+        timeline.backfill(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    counters.bump(instance.author_id, followers_count=-1)
+    counters.bump(instance.user_id, following_count=-1)
+    timeline.trim(instance.user_id, instance.author_id)
+
+
+def comment_changed(comment):
+    # число комментариев выводится в карточке поста во всех его лентах
+    post = Post.objects.filter(pk=comment.post_id).values_list('pk', 'author_id', 'group_id').first()
+    if post is not None:
+        versions.bump(*versions.post_scopes(*post))
+
+
+@receiver(post_save, sender=Comment)
+def comment_created(sender, instance, created, **kwargs):
+    if created:
+        counters.bump_comments(instance.post_id, 1)
+    comment_changed(instance)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    counters.bump_comments(instance.post_id, -1)
+    comment_changed(instance)
@@ -0,0 +1,130 @@
+"""
+Журнал медленных запросов. Обёртка SQL из posts/metrics.py передаёт сюда
+каждый запрос, выполненный во время обработки HTTP-запроса; те, что
+дольше SLOW_QUERY_MS, пишутся строкой JSON в SLOW_QUERY_LOG вместе с
+маршрутом и планом (EXPLAIN) для SELECT. Параметры запросов — личные данные
+пользователей, они попадают в журнал только при SLOW_QUERY_LOG_PARAMS.
+
+В журнал попадает доля SLOW_QUERY_SAMPLE медленных запросов и не больше
+SLOW_QUERY_MAX_PER_MINUTE записей в минуту на процесс: под нагрузкой,
+когда медленным становится всё, журнал и EXPLAIN не должны добивать базу.
+Сводку по отпечаткам запросов даёт команда slow_queries.
+"""
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError
+from django.utils import timezone
+
+_lock = threading.Lock()
+_window = [0, 0]  # минута и число записей в ней
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_LIST = re.compile(r'%s(?:\s*,\s*%s)+')
+_SPACE = re.compile(r'\s+')
+
+
+def fingerprint(sql):
+    """Запрос без конкретных значений: строки, числа и списки IN схлопнуты"""
+    normalized = _STRING.sub('?', sql)
+    normalized = _NUMBER.sub('?', normalized)
+    normalized = _LIST.sub('%s...', normalized)
+    normalized = _SPACE.sub(' ', normalized).strip()
+    return hashlib.md5(normalized.encode()).hexdigest()[:12], normalized
+
+
+def _allowed():
+    if random.random() >= settings.SLOW_QUERY_SAMPLE:
+        return False
+    minute = int(time.monotonic() // 60)
+    with _lock:
+        if _window[0] != minute:
+            _window[:] = [minute, 0]
+        if _window[1] >= settings.SLOW_QUERY_MAX_PER_MINUTE:
+            return False
+        _window[1] += 1
+    return True
+
+
+def explain(connection, sql, params):
+    # план только для чтения: EXPLAIN изменяющих запросов на части баз опасен
+    if not sql.lstrip().upper().startswith(('SELECT', 'WITH')):
+        return None
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f'{connection.ops.explain_query_prefix()} {sql}', params)
+            return [str(row[-1]) for row in cursor.fetchall()]
+    except DatabaseError:
+        return None
+
+
+def observe(stats, sql, params, many, context, seconds):
+    """Вызывается из обёртки SQL после каждого успешно выполненного запроса"""
+    threshold = settings.SLOW_QUERY_MS
+    if threshold is None or seconds * 1000 < threshold or not _allowed():
+        return
+    connection = context['connection']
+    match = stats.request.resolver_match if stats.request is not None else None
+    key, _ = fingerprint(sql)
+    stats.explaining = True
+    try:
+        plan = None if many else explain(connection, sql, params)
+    finally:
+        stats.explaining = False
+    entry = {
+        'time': timezone.now().isoformat(),
+        'ms': round(seconds * 1000, 2),
+        'view': match.view_name if match else None,
+        'path': stats.request.path if stats.request is not None else None,
+        'fingerprint': key,
+        'sql': sql,
+        'params': list(params or ()) if settings.SLOW_QUERY_LOG_PARAMS and not many else None,
+        'plan': plan,
+    }
+    line = json.dumps(entry, ensure_ascii=False, default=str)
+    with _lock:
+        with open(settings.SLOW_QUERY_LOG, 'a', encoding='utf-8') as log:
+            log.write(line + '\n')
+
+
+def read(path):
+    """Записи журнала; испорченные строки (например, оборванные) пропускаются"""
+    with open(path, encoding='utf-8') as log:
+        for line in log:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+
+def summarize(entries):
+    """Сводка по отпечаткам, худшие (по суммарному времени) первыми"""
+    groups = {}
+    for entry in entries:
+        key, normalized = fingerprint(entry['sql'])
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = {
+                'fingerprint': key, 'sql': normalized, 'count': 0, 'total_ms': 0, 'max_ms': 0,
+                'views': {}, 'plan': None, 'example': None,
+            }
+        group['count'] += 1
+        group['total_ms'] += entry['ms']
+        if entry['ms'] >= group['max_ms']:
+            group['max_ms'] = entry['ms']
+            group['example'] = {'sql': entry['sql'], 'params': entry['params'], 'time': entry['time']}
+        if entry.get('plan'):
+            group['plan'] = entry['plan']
+        view = entry.get('view') or entry.get('path') or '?'
+        group['views'][view] = group['views'].get(view, 0) + 1
+    result = sorted(groups.values(), key=lambda group: group['total_ms'], reverse=True)
+    for group in result:
+        group['total_ms'] = round(group['total_ms'], 2)
+        group['mean_ms'] = round(group['total_ms'] / group['count'], 2)
+    return result
@@ -0,0 +1,53 @@
+import hashlib
+import os
+import uuid
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Файлы называются по sha256 содержимого: posts/ab/abcdef….jpg. Повторная
+    загрузка той же картинки ничего не пишет на диск и получает то же имя,
+    а значит и те же миниатюры sorl-thumbnail и варианты картинки. Файл
+    удаляется, когда на него больше не ссылается ни один пост и его давно
+    не загружали заново (posts.thumbnails.release_image).
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # имя всё равно заменится хешем, свободное подбирать не нужно
+        return name
+
+    def _save(self, name, content):
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        digest = digest.hexdigest()
+        extension = os.path.splitext(name)[1].lower()
+        name = os.path.join(os.path.dirname(name), digest[:2], digest + extension)
+        if self.exists(name):
+            self._touch(name)
+            return name
+        # файл пишется под временным именем и появляется под настоящим
+        # целиком: get_available_name здесь не ищет свободное имя, и цикл
+        # FileSystemStorage._save на занятом имени крутился бы вечно
+        temporary = super()._save(f'{name}.{uuid.uuid4().hex}.part', content)
+        try:
+            os.link(self.path(temporary), self.path(name))
+        except FileExistsError:
+            # ту же картинку только что записал параллельный запрос
+            self._touch(name)
+        finally:
+            os.remove(self.path(temporary))
+        return name.replace('\\', '/')
+
+    def _touch(self, name):
+        # время изменения — когда файл последний раз понадобился посту;
+        # по нему release_image не удаляет картинку, которую только что
+        # загрузили ещё раз в пост, пока не закоммиченный
+        try:
+            os.utime(self.path(name))
+        except FileNotFoundError:
+            pass
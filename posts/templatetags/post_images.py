@@ -0,0 +1,32 @@
+from django import template
+
+from posts import thumbnails
+
+register = template.Library()
+
+
+@register.simple_tag
+def post_thumbnail(image, geometry, **options):
+    """
+    Готовая миниатюра картинки, а пока её нет — сама картинка; недостающая
+    миниатюра ставится в очередь пула, рендер её не ждёт.
+    """
+    if not image:
+        return None
+    prefetched = getattr(image.instance, 'prefetched_thumbnails', {})
+    key = thumbnails.options_key(geometry, options)
+    if key in prefetched:
+        found = prefetched[key]
+    else:
+        found = thumbnails.cached(image, geometry, **options)
+    if found is None:
+        thumbnails.schedule(image, [(geometry, options)])
+        return image
+    return found
+
+
+@register.simple_tag
+def prefetch_thumbnails(posts):
+    """Миниатюры всех постов страницы одним обращением к KVStore, до рендера карточек"""
+    thumbnails.prefetch(posts)
+    return ''
@@ -1,8 +1,26 @@
+import json
+import os
+import tempfile
+import time
+import zipfile
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
+
 from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.core.files.storage import default_storage
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import TestCase, Client
+from django.db import connection
+from django.test import TestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
-from .models import User, Post, Group, Follow, Comment
+from PIL import Image
+from sorl.thumbnail.models import KVStore as KVStoreModel
+from .models import User, Post, Group, Follow, Comment, Timeline, UserStats
+from .paginator import CursorPaginator
+from .storage import ContentAddressedStorage
+from .views import is_not_folower
+from . import benchmark, events, importer, metrics, search, slowlog, thumbnails, timeline
 
 TEST_POST_TEXT = 'тестовое сообщение поста'
 TEST_POST_EDIT_TEXT = 'новое сообщение тестового поста'
@@ -15,6 +33,8 @@ small_gif = (
 
 class CommonTests(TestCase):
     def setUp(self):
+        cache.clear()  # откат транзакции теста не вызывает сигналов сброса кеша
+        thumbnails.forget()  # одинаковые картинки из разных тестов — один и тот же файл
         self.client = Client()    # не авторизованный клиент
         self.user = User.objects.create_user(
             username='testuser',
@@ -196,18 +216,40 @@ class TestCache(CommonTests):
             author=self.user,
         )
         self.client.get(reverse('index'))  # закешируем страницу
-        # отредактируем пост
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('index'))  # страница из кеша, посты не запрашиваются
+        self.assertContains(response, TEST_POST_TEXT)
+        self.assertFalse([q['sql'] for q in queries if 'posts_post' in q['sql']])
+        # отредактируем пост: версия ленты меняется, кеш сбрасывать не нужно
         self.client_logined.post(reverse('post_edit',
                                          kwargs={'username': self.user.username, 'post_id': post.pk}
                                          ),
                                  {'group': self.group.pk, 'text': TEST_POST_EDIT_TEXT},
                                  follow=True
                                  )
-        response = self.client.get(reverse('index'))  # вызовим страницу, должна быть из кеша
-        self.assertContains(response, TEST_POST_TEXT)  # текст поста не изменился
+        for url in (reverse('index'),
+                    reverse('group', kwargs={'slug': self.group.slug}),
+                    reverse('profile', kwargs={'username': self.user.username})):
+            response = self.client.get(url)
+            self.assertContains(response, TEST_POST_EDIT_TEXT, msg_prefix=f'for url = {url}')
+
+    def test_comment_invalidates_feed(self):
+        cache.clear()
+        post = Post.objects.create(text=TEST_POST_TEXT, group=self.group, author=self.user)
+        self.client.get(reverse('group', kwargs={'slug': self.group.slug}))
+        Comment.objects.create(post=post, author=self.user, text=TEST_POST_EDIT_TEXT)
+        response = self.client.get(reverse('group', kwargs={'slug': self.group.slug}))
+        self.assertContains(response, '1 комментариев')
+
+    def test_moved_post_leaves_old_group(self):
         cache.clear()
-        response = self.client.get(reverse('index'))  # вызовим страницу, должна обновиться
-        self.assertContains(response, TEST_POST_EDIT_TEXT)  # текст поста изменился
+        other = Group.objects.create(title='other', slug='other', description='description')
+        post = Post.objects.create(text=TEST_POST_TEXT, group=self.group, author=self.user)
+        self.client.get(reverse('group', kwargs={'slug': self.group.slug}))
+        post.group = other
+        post.save()
+        response = self.client.get(reverse('group', kwargs={'slug': self.group.slug}))
+        self.assertNotContains(response, TEST_POST_TEXT)
 
 
 class TestFollows(CommonTests):
@@ -233,6 +275,14 @@ class TestFollows(CommonTests):
         self.assertEqual(request.status_code, 200, msg='Follow error')
         self.assertEqual(Follow.objects.all().count(), 1, msg='In the base there is not the following')
 
+    def test_repeated_following(self):
+        url = reverse('profile_follow', kwargs={'username': self.user_author.username})
+        self.client_logined.get(url)
+        response = self.client_logined.get(url)
+        self.assertRedirects(response, reverse('profile', kwargs={'username': self.user_author.username}))
+        self.assertEqual(Follow.objects.count(), 1)
+        self.assertEqual(UserStats.objects.get(user=self.user_author).followers_count, 1)
+
     def test_authoryted_unfollowing(self):
         Follow.objects.create(user=self.user, author=self.user_author)  # подписка на автора
         request = self.client_logined.post(reverse('profile_unfollow', kwargs={'username': self.user_author.username}),
@@ -288,3 +338,1180 @@ class TestComments(CommonTests):
                                     )
         self.assertEqual(Comment.objects.all().count(), 1)  # комментов в базе не изменилось
         self.assertContains(response, f'{reverse("login")}')  # редирект на логин
+
+
+class TestCursorPagination(CommonTests):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        Post.objects.bulk_create(
+            Post(text=f'пост {i}', group=self.group, author=self.user) for i in range(25)
+        )
+        # половина постов с одинаковой датой: порядок внутри неё задаёт id
+        Post.objects.filter(pk__in=list(Post.objects.values_list('pk', flat=True)[:12])).update(
+            pub_date=Post.objects.first().pub_date
+        )
+
+    def walk(self, url):
+        seen = []
+        response = self.client.get(url)
+        while True:
+            page = response.context['page']
+            seen.extend(post.pk for post in page)
+            if not page.has_next():
+                return seen, response
+            response = self.client.get(url, {'after': page.next_cursor()})
+
+    def test_pages_cover_feed_without_gaps(self):
+        expected = list(Post.objects.order_by('-pub_date', '-pk').values_list('pk', flat=True))
+        for url in (reverse('index'),
+                    reverse('group', kwargs={'slug': self.group.slug}),
+                    reverse('profile', kwargs={'username': self.user.username})):
+            seen, response = self.walk(url)
+            self.assertEqual(seen, expected, msg=f'for url = {url}')
+            self.assertEqual(len(response.context['page']), 5)
+
+    def test_previous_page(self):
+        first = self.client.get(reverse('index')).context['page']
+        second = self.client.get(reverse('index'), {'after': first.next_cursor()}).context['page']
+        back = self.client.get(reverse('index'), {'before': second.previous_cursor()}).context['page']
+        self.assertEqual(list(back), list(first))
+        self.assertFalse(back.has_previous())
+
+    def test_bad_cursor_gives_first_page(self):
+        first = self.client.get(reverse('index')).context['page']
+        page = self.client.get(reverse('index'), {'after': 'испорчен'}).context['page']
+        self.assertEqual(list(page), list(first))
+
+    def test_no_count_query(self):
+        cursor = self.client.get(reverse('index')).context['page'].next_cursor()
+        with self.assertNumQueries(1):
+            page = CursorPaginator(Post.objects.all(), 10).get_page(after=cursor)
+            self.assertEqual(len(page), 10)
+
+
+class TestTimeline(CommonTests):
+    def setUp(self):
+        super().setUp()
+        self.author = User.objects.create_user(username='timelineauthor', password='1235678')
+        self.old_post = Post.objects.create(text=TEST_POST_TEXT, author=self.author)
+
+    def test_follow_backfills_and_unfollow_trims(self):
+        self.client_logined.get(reverse('profile_follow', kwargs={'username': self.author.username}))
+        self.assertEqual(list(self.user.timeline.values_list('post', flat=True)), [self.old_post.pk])
+        self.client_logined.get(reverse('profile_unfollow', kwargs={'username': self.author.username}))
+        self.assertFalse(self.user.timeline.exists())
+
+    def test_new_post_fans_out(self):
+        Follow.objects.create(user=self.user, author=self.author)
+        post = Post.objects.create(text=TEST_POST_EDIT_TEXT, author=self.author)
+        entry = self.user.timeline.get(post=post)
+        self.assertEqual(entry.pub_date, post.pub_date)
+
+    def test_follow_index_reads_timeline(self):
+        cache.clear()
+        Follow.objects.create(user=self.user, author=self.author)
+        Follow.objects.filter(user=self.user).delete()
+        # строки ленты без подписки: страница строится только по Timeline
+        Timeline.objects.create(user=self.user, post=self.old_post, pub_date=self.old_post.pub_date)
+        response = self.client_logined.get(reverse('follow_index'))
+        self.assertEqual(list(response.context['page']), [self.old_post])
+
+
+@override_settings(TIMELINE_FANOUT_MAX_FOLLOWERS=1)
+class TestHybridTimeline(CommonTests):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.star = User.objects.create_user(username='staruser', password='1235678')
+        self.friend = User.objects.create_user(username='frienduser', password='1235678')
+        other = User.objects.create_user(username='otheruser', password='1235678')
+        Follow.objects.create(user=self.user, author=self.star)
+        Follow.objects.create(user=other, author=self.star)
+        Follow.objects.create(user=self.user, author=self.friend)
+
+    def test_popular_author_is_not_fanned_out(self):
+        Post.objects.create(text=TEST_POST_TEXT, author=self.star)
+        self.assertFalse(Timeline.objects.filter(post__author=self.star).exists())
+        Post.objects.create(text=TEST_POST_TEXT, author=self.friend)
+        self.assertTrue(self.user.timeline.filter(post__author=self.friend).exists())
+
+    def test_feed_merges_pulled_posts(self):
+        for i in range(8):
+            Post.objects.create(text=f'пост {i}', author=self.star if i % 2 else self.friend)
+        expected = list(Post.objects.order_by('-pub_date', '-pk'))
+        first = self.client_logined.get(reverse('follow_index')).context['page']
+        self.assertEqual(list(first), expected)
+        paginator = timeline.paginator(self.user, 3, timeline.followed_authors(self.user))
+        page = paginator.get_page()
+        self.assertEqual(list(page), expected[:3])
+        page = paginator.get_page(after=page.next_cursor())
+        self.assertEqual(list(page), expected[3:6])
+
+    def test_pulled_posts_survive_crossing_back(self):
+        pulled = Post.objects.create(text='пока популярен', author=self.star)
+        # подписчиков стало меньше порога, но пропущенный пост в лентах так и
+        # не появился: автор остаётся «читаемым при показе»
+        Follow.objects.filter(author=self.star).exclude(user=self.user).delete()
+        self.assertTrue(UserStats.objects.get(user=self.star).timeline_pulled)
+        later = Post.objects.create(text='уже не популярен', author=self.star)
+        cache.clear()
+        page = self.client_logined.get(reverse('follow_index')).context['page']
+        self.assertEqual([post for post in page if post.author == self.star], [later, pulled])
+        # и снова выше порога: ничего не теряется и не дублируется
+        Follow.objects.create(user=self.friend, author=self.star)
+        again = Post.objects.create(text='снова популярен', author=self.star)
+        self.assertFalse(Timeline.objects.filter(post=again).exists())
+        cache.clear()
+        page = self.client_logined.get(reverse('follow_index')).context['page']
+        self.assertEqual([post for post in page if post.author == self.star], [again, later, pulled])
+
+
+class TestFeedQueries(CommonTests):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        Follow.objects.create(user=self.user, author=self.user)
+        for i in range(10):
+            post = Post.objects.create(text=f'пост {i}', group=self.group, author=self.user)
+            Comment.objects.create(post=post, author=self.user, text='комментарий')
+
+    def test_feed_pages_have_constant_queries(self):
+        urls = {
+            reverse('index'): 1,
+            reverse('group', kwargs={'slug': self.group.slug}): 2,
+            reverse('follow_index'): 2,
+        }
+        for url, queries in urls.items():
+            cache.clear()
+            # сессия и пользователь для авторизованного клиента: ещё два запроса
+            with self.assertNumQueries(queries + 2):
+                response = self.client_logined.get(url)
+            self.assertContains(response, '1 комментариев')
+
+
+class TestUserStats(CommonTests):
+    def setUp(self):
+        super().setUp()
+        self.author = User.objects.create_user(username='statsauthor', password='1235678')
+
+    def test_counters_follow_changes(self):
+        Post.objects.create(text=TEST_POST_TEXT, author=self.author)
+        self.client_logined.get(reverse('profile_follow', kwargs={'username': self.author.username}))
+        self.author.stats.refresh_from_db()
+        self.user.stats.refresh_from_db()
+        self.assertEqual((self.author.stats.posts_count, self.author.stats.followers_count), (1, 1))
+        self.assertEqual(self.user.stats.following_count, 1)
+
+        self.client_logined.get(reverse('profile_unfollow', kwargs={'username': self.author.username}))
+        Post.objects.filter(author=self.author).delete()
+        self.author.stats.refresh_from_db()
+        self.assertEqual((self.author.stats.posts_count, self.author.stats.followers_count), (0, 0))
+
+    def test_reconcile_counters(self):
+        Follow.objects.create(user=self.user, author=self.author)
+        UserStats.objects.update(posts_count=7, followers_count=7, following_count=7)
+        call_command('reconcile_counters', stdout=StringIO())
+        self.assertEqual(
+            list(UserStats.objects.filter(user=self.author).values_list(
+                'posts_count', 'followers_count', 'following_count')),
+            [(0, 1, 0)],
+        )
+
+    def test_profile_has_no_aggregate_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('profile', kwargs={'username': self.author.username}))
+        self.assertContains(response, 'Подписчиков: 0')
+        self.assertFalse([q['sql'] for q in queries if q['sql'].startswith('SELECT COUNT(')])
+
+
+class TestCommentCount(CommonTests):
+    def test_comment_count_follows_comments(self):
+        post = Post.objects.create(text=TEST_POST_TEXT, author=self.user)
+        self.client_logined.post(reverse('add_comment', kwargs={'username': self.user.username, 'post_id': post.pk}),
+                                 {'text': TEST_POST_EDIT_TEXT})
+        post.refresh_from_db()
+        self.assertEqual(post.comment_count, 1)
+        Comment.objects.all().delete()
+        post.refresh_from_db()
+        self.assertEqual(post.comment_count, 0)
+
+    def test_reconcile_comment_count(self):
+        post = Post.objects.create(text=TEST_POST_TEXT, author=self.user)
+        Comment.objects.create(post=post, author=self.user, text=TEST_POST_EDIT_TEXT)
+        Post.objects.update(comment_count=5)
+        call_command('reconcile_counters', stdout=StringIO())
+        post.refresh_from_db()
+        self.assertEqual(post.comment_count, 1)
+
+    def test_edit_keeps_concurrent_comment(self):
+        post = Post.objects.create(text=TEST_POST_TEXT, author=self.user)
+        stale = Post.objects.get(pk=post.pk)  # форма правки открыта до комментария
+        Comment.objects.create(post=post, author=self.user, text=TEST_POST_EDIT_TEXT)
+        stale.text = TEST_POST_EDIT_TEXT
+        stale.save()
+        post.refresh_from_db()
+        self.assertEqual((post.text, post.comment_count), (TEST_POST_EDIT_TEXT, 1))
+
+    def test_admin_cannot_edit_comment_count(self):
+        post = Post.objects.create(text=TEST_POST_TEXT, author=self.user)
+        User.objects.filter(pk=self.user.pk).update(is_staff=True, is_superuser=True)
+        response = self.client_logined.get(reverse('admin:posts_post_change', args=[post.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, 'name="comment_count"')
+
+
+class TestFollowCache(CommonTests):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.author = User.objects.create_user(username='cacheauthor', password='1235678')
+        Post.objects.create(text=TEST_POST_TEXT, author=self.author)
+
+    def test_follow_feed_does_not_share_index_cache(self):
+        self.client_logined.get(reverse('index'))
+        response = self.client_logined.get(reverse('follow_index'))
+        self.assertNotContains(response, TEST_POST_TEXT)
+
+    def test_follow_and_post_invalidate_feed(self):
+        self.client_logined.get(reverse('follow_index'))
+        self.client_logined.get(reverse('profile_follow', kwargs={'username': self.author.username}))
+        response = self.client_logined.get(reverse('follow_index'))
+        self.assertContains(response, TEST_POST_TEXT)
+
+        Post.objects.create(text=TEST_POST_EDIT_TEXT, author=self.author)
+        response = self.client_logined.get(reverse('follow_index'))
+        self.assertContains(response, TEST_POST_EDIT_TEXT)
+
+        self.client_logined.get(reverse('profile_unfollow', kwargs={'username': self.author.username}))
+        response = self.client_logined.get(reverse('follow_index'))
+        self.assertNotContains(response, TEST_POST_TEXT)
+
+    def test_cached_feed_skips_query(self):
+        Follow.objects.create(user=self.user, author=self.author)
+        self.client_logined.get(reverse('follow_index'))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client_logined.get(reverse('follow_index'))
+        self.assertContains(response, TEST_POST_TEXT)
+        self.assertFalse([q['sql'] for q in queries if 'posts_timeline' in q['sql']])
+
+
+class TestAnonymousPageCache(CommonTests):
+    def setUp(self):
+        super().setUp()
+        self.post = Post.objects.create(text=TEST_POST_TEXT, group=self.group, author=self.user)
+        self.urls = (reverse('index'),
+                     reverse('group', kwargs={'slug': self.group.slug}),
+                     reverse('profile', kwargs={'username': self.user.username}),
+                     reverse('post', kwargs={'username': self.user.username, 'post_id': self.post.pk}))
+
+    def test_anonymous_hit_skips_orm(self):
+        for url in self.urls:
+            self.client.get(url)
+            with self.assertNumQueries(0):
+                response = self.client.get(url)
+            self.assertContains(response, TEST_POST_TEXT)
+            self.assertTrue(response.has_header('Surrogate-Key'))
+
+    def test_logged_in_pages_are_not_cached(self):
+        self.client_logined.get(reverse('index'))
+        response = self.client_logined.get(reverse('index'))
+        self.assertIsNotNone(response.context)
+
+    def test_writes_purge_pages(self):
+        for url in self.urls:
+            self.client.get(url)
+        self.client_logined.post(reverse('post_edit',
+                                         kwargs={'username': self.user.username, 'post_id': self.post.pk}),
+                                 {'group': self.group.pk, 'text': TEST_POST_EDIT_TEXT})
+        for url in self.urls:
+            self.assertContains(self.client.get(url), TEST_POST_EDIT_TEXT, msg_prefix=f'for url = {url}')
+
+        Comment.objects.create(post=self.post, author=self.user, text='новый комментарий')
+        self.assertContains(self.client.get(self.urls[-1]), 'новый комментарий')
+
+        reader = User.objects.create_user(username='reader', password='1235678')
+        Follow.objects.create(user=reader, author=self.user)
+        self.assertContains(self.client.get(self.urls[2]), 'Подписчиков: 1')
+
+
+class TestConditionalGet(CommonTests):
+    def setUp(self):
+        super().setUp()
+        self.post = Post.objects.create(text=TEST_POST_TEXT, group=self.group, author=self.user)
+        self.urls = (reverse('index'),
+                     reverse('group', kwargs={'slug': self.group.slug}),
+                     reverse('profile', kwargs={'username': self.user.username}),
+                     reverse('post', kwargs={'username': self.user.username, 'post_id': self.post.pk}),
+                     reverse('follow_index'))
+
+    def test_etag_gives_not_modified(self):
+        for url in self.urls:
+            self.client_logined.get(url)  # страница поста выставляет csrf-куку, она входит в ETag
+            etag = self.client_logined.get(url)['ETag']
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client_logined.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304, msg=url)
+            # сессия, пользователь и один маленький запрос за id группы/автора
+            self.assertLessEqual(len(queries), 3, msg=url)
+
+    def test_last_modified_for_anonymous(self):
+        response = self.client.get(self.urls[0])
+        self.assertNotIn('Last-Modified', self.client_logined.get(self.urls[0]))
+        response = self.client.get(self.urls[0], HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_rename_gives_new_etag(self):
+        Follow.objects.create(user=self.user, author=self.user)
+        urls = self.urls + (reverse('api_post', kwargs={'post_id': self.post.pk}),
+                            reverse('api_profile', kwargs={'username': self.user.username}))
+        for rename in ('group', 'author'):
+            etags = [self.client_logined.get(url)['ETag'] for url in urls]
+            if rename == 'group':
+                self.group.title = 'новое название'
+                self.group.save()
+            else:
+                self.user.first_name = 'Новое имя'
+                self.user.save()
+            for url, etag in zip(urls, etags):
+                response = self.client_logined.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200, msg=f'{rename} {url}')
+
+    @override_settings(VERSION_TIMEOUT=0.2)
+    def test_validators_expire_without_shared_cache(self):
+        url = self.urls[0]
+        cache.clear()  # версии из setUp записаны ещё с обычным сроком
+        self.client_logined.get(url)
+        etag = self.client_logined.get(url)['ETag']
+        modified = self.client.get(url)['Last-Modified']
+        # запись в другом процессе версии этого процесса не сбрасывает
+        Post.objects.filter(pk=self.post.pk).update(text=TEST_POST_EDIT_TEXT)
+        time.sleep(1.1)  # Last-Modified — с точностью до секунды
+        self.assertEqual(self.client_logined.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=modified).status_code, 200)
+
+    def test_signup_and_password_keep_etag(self):
+        etags = [self.client.get(url)['ETag'] for url in self.urls[:4]]
+        newcomer = User.objects.create_user(username='newcomer', password='1235678')
+        newcomer.set_password('другой-пароль')
+        newcomer.save()
+        for url, etag in zip(self.urls, etags):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304, msg=url)
+
+    def test_change_gives_new_etag(self):
+        etags = [self.client_logined.get(url)['ETag'] for url in self.urls]
+        Follow.objects.create(user=self.user, author=self.user)
+        Comment.objects.create(post=self.post, author=self.user, text=TEST_POST_EDIT_TEXT)
+        for url, etag in zip(self.urls, etags):
+            response = self.client_logined.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200, msg=url)
+
+    def test_viewer_changes_etag(self):
+        etag = self.client.get(self.urls[0])['ETag']
+        response = self.client_logined.get(self.urls[0], HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+class TestSearch(CommonTests):
+    def search(self, query, **params):
+        return self.client.get(reverse('search'), {'q': query, **params})
+
+    def test_search_finds_words_and_prefixes(self):
+        post = Post.objects.create(text='Котики на прогулке', author=self.user)
+        Post.objects.create(text='Собаки дома', author=self.user)
+        for query in ('котики', 'прогул', 'КОТИКИ прогулке'):
+            self.assertEqual(list(self.search(query).context['page']), [post], msg=query)
+        self.assertEqual(list(self.search('жирафы').context['page']), [])
+
+    def test_search_without_fts_is_empty(self):
+        Post.objects.create(text='Котики на прогулке', author=self.user)
+        with mock.patch.object(search, 'available', return_value=False):
+            response = self.search('котики')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context['page']), [])
+
+    def test_index_follows_edit_and_delete(self):
+        post = Post.objects.create(text='старый текст', author=self.user)
+        self.client_logined.post(reverse('post_edit', kwargs={'username': self.user.username, 'post_id': post.pk}),
+                                 {'text': 'новый текст'})
+        self.assertEqual(len(self.search('старый').context['page']), 0)
+        self.assertEqual(len(self.search('новый').context['page']), 1)
+        post.delete()
+        self.assertEqual(len(self.search('новый').context['page']), 0)
+
+    def test_query_syntax_is_not_interpreted(self):
+        Post.objects.create(text='текст с "кавычками" и OR NOT', author=self.user)
+        for query in ('"', 'OR', 'NOT (', 'text:*', '***'):
+            self.assertEqual(self.search(query).status_code, 200, msg=query)
+
+    def test_results_are_ranked_and_paginated(self):
+        for i in range(12):
+            Post.objects.create(text='слон ' + 'вода ' * i, author=self.user)
+        best = Post.objects.create(text='слон слон слон', author=self.user)
+        page = self.search('слон').context['page']
+        self.assertEqual(page[0], best)
+        self.assertTrue(page.has_next())
+        rest = self.search('слон', after=page.next_cursor()).context['page']
+        self.assertEqual(len(page) + len(rest), 13)
+        self.assertFalse(set(page) & set(rest))
+        back = self.search('слон', before=rest.previous_cursor()).context['page']
+        self.assertEqual(list(back), list(page))
+
+    def test_admin_search_uses_index(self):
+        Post.objects.create(text='Котики на прогулке', author=self.user)
+        User.objects.create_superuser(username='admin', email='admin@tt.ru', password='1235678')
+        admin = Client()
+        admin.login(username='admin', password='1235678')
+        response = admin.get('/admin/posts/post/', {'q': 'котики'})
+        self.assertEqual(response.context['cl'].result_count, 1)
+
+
+class TestThumbnails(CommonTests):
+    def setUp(self):
+        super().setUp()
+        img = SimpleUploadedFile(name='thumb.gif', content=small_gif, content_type='image/gif')
+        self.post = Post.objects.create(text=TEST_POST_TEXT, author=self.user, image=img)
+
+    def test_feed_does_not_render_thumbnails(self):
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, self.post.image.url)
+        self.assertIsNone(thumbnails.cached(self.post.image, '960x339', crop='center', upscale=True))
+
+    def test_feed_uses_ready_thumbnail(self):
+        thumbnails.generate(self.post.image.name)
+        thumbnail = thumbnails.cached(self.post.image, '960x339', crop='center', upscale=True)
+        self.assertIsNotNone(thumbnail)
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, thumbnail.url)
+        self.assertNotContains(response, self.post.image.url)
+
+    @override_settings(POST_THUMBNAIL_MISS_TIMEOUT=0.1)
+    def test_thumbnail_from_pool_is_found_after_miss(self):
+        thumbnails.generate(self.post.image.name)
+        rows = list(KVStoreModel.objects.all())
+        KVStoreModel.objects.all().delete()
+        cache.clear()
+        thumbnails.forget()
+        self.assertIsNone(thumbnails.cached(self.post.image, '960x339', crop='center', upscale=True))
+        # пул пишет строки KVStore через свой кеш, кеш этого процесса о них не знает
+        KVStoreModel.objects.bulk_create(rows)
+        time.sleep(0.2)
+        self.assertIsNotNone(thumbnails.cached(self.post.image, '960x339', crop='center', upscale=True))
+
+
+def make_png(size):
+    buffer = BytesIO()
+    Image.new('RGB', size, (200, 30, 30)).save(buffer, 'PNG')
+    return SimpleUploadedFile(name='big.png', content=buffer.getvalue(), content_type='image/png')
+
+
+def make_jpeg(size):
+    buffer = BytesIO()
+    exif = Image.Exif()
+    exif[0x010f] = 'Camera'  # Make
+    Image.new('RGB', size, (30, 200, 30)).save(buffer, 'JPEG', exif=exif)
+    return SimpleUploadedFile(name='photo.jpeg', content=buffer.getvalue(), content_type='image/jpeg')
+
+
+class TestImageVariants(CommonTests):
+    def setUp(self):
+        super().setUp()
+        self.post = Post.objects.create(text=TEST_POST_TEXT, author=self.user, image=make_png((1000, 500)))
+
+    def test_variants_are_stored_on_post(self):
+        thumbnails.save_variants(self.post.pk, self.post.image.name, thumbnails.build_variants(self.post.image.name))
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.image_width, self.post.image_height), (1000, 500))
+        self.assertEqual([v['width'] for v in self.post.variants], [320, 640, 960, 1000])
+        self.assertTrue(self.post.image_placeholder.startswith('data:image/jpeg;base64,'))
+
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, f'srcset="{self.post.image_srcset}"')
+        self.assertContains(response, 'width="1000" height="500"')
+        self.assertContains(response, 'loading="lazy"')
+
+    def test_replaced_image_keeps_no_stale_variants(self):
+        name = self.post.image.name
+        fields = thumbnails.build_variants(name)
+        self.client_logined.post(reverse('post_edit', kwargs={'username': self.user.username, 'post_id': self.post.pk}),
+                                 {'text': TEST_POST_TEXT, 'image': make_png((50, 50))})
+        thumbnails.save_variants(self.post.pk, name, fields)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.variants, [])
+
+    def test_image_replaced_outside_form_resets_variants(self):
+        thumbnails.save_variants(self.post.pk, self.post.image.name, thumbnails.build_variants(self.post.image.name))
+        self.post.refresh_from_db()
+        self.post.image = make_png((50, 50))
+        self.post.save()
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.image_width, self.post.image_height, self.post.variants), (None, None, []))
+
+
+class TestThumbnailPrefetch(CommonTests):
+    def test_page_thumbnails_in_one_lookup(self):
+        posts = []
+        for i in range(5):
+            posts.append(Post.objects.create(text=TEST_POST_TEXT, author=self.user, image=make_png((i + 1, 1))))
+        for post in posts[:3]:
+            thumbnails.generate(post.image.name)
+        cache.clear()
+        posts = list(Post.objects.all())
+        with self.assertNumQueries(1):  # кеш пуст: одна выборка из KVStore на всю страницу
+            thumbnails.prefetch(posts)
+        ready = [post for post in posts if list(post.prefetched_thumbnails.values()) != [None]]
+        self.assertEqual(len(ready), 3)
+        with self.assertNumQueries(0):  # теперь ответ есть в кеше и в памяти процесса
+            thumbnails.prefetch(posts)
+
+        key = thumbnails.options_key('960x339', {'crop': 'center', 'upscale': True})
+        response = self.client.get(reverse('index'))
+        for post in ready:
+            self.assertContains(response, post.prefetched_thumbnails[key].url)
+
+
+class TestUploadNormalization(CommonTests):
+    def upload(self, image):
+        return self.client_logined.post(reverse('new'), {'text': TEST_POST_TEXT, 'image': image})
+
+    @override_settings(POST_IMAGE_MAX_SIZE=400)
+    def test_downscaled_and_stripped(self):
+        self.upload(make_jpeg((1000, 600)))
+        post = Post.objects.get()
+        self.assertTrue(post.image.name.endswith('.jpg'))
+        with Image.open(post.image.path) as image:
+            self.assertEqual(image.size, (400, 240))
+            self.assertEqual(dict(image.getexif()), {})
+
+    def test_transparent_image_stays_png(self):
+        buffer = BytesIO()
+        Image.new('RGBA', (20, 20), (0, 0, 0, 0)).save(buffer, 'PNG')
+        self.upload(SimpleUploadedFile(name='clear.png', content=buffer.getvalue(), content_type='image/png'))
+        with Image.open(Post.objects.get().image.path) as image:
+            self.assertEqual(image.format, 'PNG')
+            self.assertIn('A', image.getbands())
+
+    @override_settings(POST_IMAGE_MAX_PIXELS=100 * 100)
+    def test_pixel_bomb_rejected(self):
+        response = self.upload(make_png((200, 200)))
+        self.assertEqual(Post.objects.count(), 0)
+        self.assertFormError(response, 'form', 'image', 'Картинка слишком большая: 200×200 точек.')
+
+    def test_truncated_image_rejected(self):
+        content = make_jpeg((400, 300)).read()
+        # заголовок цел, обрезаны данные: проверку ImageField такой файл проходит
+        truncated = SimpleUploadedFile(name='photo.jpeg', content=content[:len(content) // 2],
+                                       content_type='image/jpeg')
+        response = self.upload(truncated)
+        self.assertEqual(Post.objects.count(), 0)
+        self.assertFormError(response, 'form', 'image', 'Не удалось прочитать картинку: файл повреждён.')
+
+
+@override_settings(POST_THUMBNAIL_WORKERS=0)
+class TestContentAddressedImages(CommonTests):
+    def upload(self):
+        self.client_logined.post(reverse('new'), {'text': TEST_POST_TEXT, 'image': make_png((60, 40))})
+        return Post.objects.order_by('-pk').first()
+
+    def test_same_content_same_file(self):
+        first, second = self.upload(), self.upload()
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertRegex(first.image.name, r'^posts/[0-9a-f]{2}/[0-9a-f]{64}\.jpg$')
+
+    def test_variants_reused_for_duplicate(self):
+        first = self.upload()
+        thumbnails.submit_variants(first.pk, first.image.name)
+        second = self.upload()
+        with self.assertNumQueries(3):  # варианты первого поста, проверка картинки, запись
+            thumbnails.submit_variants(second.pk, second.image.name)
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(second.image_variants, first.image_variants)
+
+    @override_settings(POST_IMAGE_RELEASE_GRACE=0)
+    def test_file_removed_with_last_reference(self):
+        first, second = self.upload(), self.upload()
+        thumbnails.submit_variants(first.pk, first.image.name)
+        first.refresh_from_db()
+        name, variants = first.image.name, [variant['name'] for variant in first.variants]
+        first.delete()
+        thumbnails._release(name, variants)  # в тесте колбэки on_commit не выполняются
+        self.assertTrue(default_storage.exists(name))
+        second.delete()
+        thumbnails._release(name, variants)
+        self.assertFalse(default_storage.exists(name))
+        for variant in variants:
+            self.assertFalse(default_storage.exists(variant))
+
+    def test_recently_uploaded_file_kept(self):
+        post = self.upload()
+        name = post.image.name
+        post.delete()
+        # тот же файл мог получить пост, который ещё не закоммичен
+        thumbnails._release(name, [])
+        self.assertTrue(default_storage.exists(name))
+
+    def test_concurrent_save_of_same_file(self):
+        class Racing(ContentAddressedStorage):
+            def exists(self, name):
+                return False  # другой запрос записал файл после проверки
+
+        storage = Racing(location=default_storage.location)
+        first = storage.save('posts/big.png', make_png((60, 40)))
+        second = storage.save('posts/big.png', make_png((60, 40)))
+        self.assertEqual(first, second)
+        self.assertEqual(os.listdir(os.path.dirname(storage.path(first))), [os.path.basename(first)])
+
+
+@override_settings(LIVE_FEED_ENABLED=True, EVENTS_STREAM_SECONDS=0.2, EVENTS_KEEPALIVE_SECONDS=0.05)
+class TestFeedEvents(CommonTests):
+    def stream(self, client, last_id, **params):
+        response = client.get(reverse('feed_events'), params, HTTP_LAST_EVENT_ID=str(last_id))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        return b''.join(response.streaming_content).decode()
+
+    def test_subscribers_get_published_events(self):
+        subscriber = events.subscribe()
+        event_id = events.publish({'type': 'post', 'post_id': 1})
+        self.assertEqual(subscriber.get_nowait()['id'], event_id)
+        events.unsubscribe(subscriber)
+
+    def test_stream_replays_missed_posts(self):
+        other = User.objects.create_user(username='other', password='1235678')
+        start = events.publish({'type': 'ping'})
+        for author in (self.user, other):
+            post = Post.objects.create(text=TEST_POST_TEXT, author=author)
+            events.publish(events.post_event(post))
+
+        body = self.stream(self.client, start)
+        self.assertIn('retry: ', body)
+        self.assertIn(f'"url": "/{self.user.username}/', body)
+        self.assertIn('"url": "/other/', body)
+        self.assertIn(': keepalive', body)
+
+        Follow.objects.create(user=self.user, author=other)
+        body = self.stream(self.client_logined, start, feed='follow')
+        self.assertNotIn(f'"url": "/{self.user.username}/', body)
+        self.assertIn('"url": "/other/', body)
+
+    def test_follow_stream_needs_login(self):
+        response = self.client.get(reverse('feed_events'), {'feed': 'follow'})
+        self.assertEqual(response.status_code, 403)
+
+    def test_switched_off_by_setting(self):
+        self.assertContains(self.client.get(reverse('index')), 'id="live-feed"')
+        with self.settings(LIVE_FEED_ENABLED=False):
+            cache.clear()
+            self.assertNotContains(self.client.get(reverse('index')), 'id="live-feed"')
+            self.assertEqual(self.client.get(reverse('feed_events')).status_code, 404)
+
+
+class TestApi(CommonTests):
+    def setUp(self):
+        super().setUp()
+        self.other = User.objects.create_user(username='other', password='1235678')
+        for i in range(3):
+            Post.objects.create(text=f'{TEST_POST_TEXT} {i}', author=self.user, group=self.group)
+        self.other_post = Post.objects.create(text=TEST_POST_TEXT, author=self.other)
+        Comment.objects.create(post=self.other_post, author=self.user, text=TEST_POST_EDIT_TEXT)
+
+    def get(self, client, url, **params):
+        response = client.get(url, params)
+        self.assertEqual(response.status_code, 200, msg=url)
+        return response.json()
+
+    def test_index_pages_through_posts(self):
+        with self.assertNumQueries(1):
+            first = self.get(self.client, reverse('api_index'), limit=3)
+        self.assertEqual([post['id'] for post in first['results']],
+                         list(Post.objects.order_by('-pub_date').values_list('pk', flat=True)[:3]))
+        self.assertEqual(first['results'][0]['author'], 'other')
+        second = self.get(self.client, reverse('api_index'), limit=3, after=first['next'])
+        self.assertEqual(len(second['results']), 1)
+        self.assertIsNone(second['next'])
+        self.assertIsNotNone(second['previous'])
+
+    def test_group_profile_and_post(self):
+        group = self.get(self.client, reverse('api_group', kwargs={'slug': self.group.slug}))
+        self.assertEqual({post['group'] for post in group['results']}, {self.group.slug})
+        profile = self.get(self.client, reverse('api_profile', kwargs={'username': 'other'}))
+        self.assertEqual([post['id'] for post in profile['results']], [self.other_post.pk])
+        post = self.get(self.client, reverse('api_post', kwargs={'post_id': self.other_post.pk}))
+        self.assertEqual(post['comment_count'], 1)
+        comments = self.get(self.client, reverse('api_comments', kwargs={'post_id': self.other_post.pk}))
+        self.assertEqual([comment['text'] for comment in comments['results']], [TEST_POST_EDIT_TEXT])
+        for name in ('api_post', 'api_comments'):
+            response = self.client.get(reverse(name, kwargs={'post_id': 999}))
+            self.assertEqual(response.status_code, 404)
+            self.assertEqual(response['Content-Type'], 'application/json')
+            # у «не найдено» нет валидаторов версий: повторный запрос не получит 304
+            self.assertFalse(response.has_header('Last-Modified'))
+            if response.has_header('ETag'):
+                again = self.client.get(reverse(name, kwargs={'post_id': 999}), HTTP_IF_NONE_MATCH=response['ETag'])
+                self.assertEqual(again.status_code, 404)
+
+    def test_follow_feed_with_pulled_author(self):
+        self.assertEqual(self.client.get(reverse('api_follow_index')).status_code, 403)
+        Follow.objects.create(user=self.user, author=self.other)
+        with override_settings(TIMELINE_FANOUT_MAX_FOLLOWERS=0):
+            Post.objects.create(text='pulled', author=self.other)
+            feed = self.get(self.client_logined, reverse('api_follow_index'))
+        self.assertEqual([post['text'] for post in feed['results']], ['pulled', TEST_POST_TEXT])
+
+    def test_conditional_get(self):
+        response = self.client_logined.get(reverse('api_index'))
+        response = self.client_logined.get(reverse('api_index'), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+
+class TestImportExport(CommonTests):
+    def write_jsonl(self, rows):
+        handle, path = tempfile.mkstemp(suffix='.jsonl')
+        with os.fdopen(handle, 'w', encoding='utf-8') as file_:
+            for row in rows:
+                file_.write(json.dumps(row, ensure_ascii=False) + '\n')
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_import_builds_derived_data(self):
+        path = self.write_jsonl([
+            {'type': 'user', 'username': 'writer'},
+            {'type': 'group', 'slug': 'imported', 'title': 'Импорт'},
+            {'type': 'post', 'id': 500, 'author': 'writer', 'group': 'imported', 'text': 'импортированный пост',
+             'pub_date': '2019-05-01T10:00:00+00:00'},
+            {'type': 'post', 'id': 501, 'author': 'writer', 'text': 'второй', 'pub_date': '2019-05-02T10:00:00+00:00'},
+            {'type': 'comment', 'post': 500, 'author': self.user.username, 'text': 'комментарий',
+             'created': '2019-05-03T10:00:00+00:00'},
+            {'type': 'follow', 'user': self.user.username, 'author': 'writer'},
+        ])
+        call_command('import_content', path, '--batch-size', '2', stdout=StringIO())
+        writer = User.objects.get(username='writer')
+        post = Post.objects.get(text='импортированный пост')
+        self.assertEqual(post.pub_date.year, 2019)
+        self.assertEqual(post.group.slug, 'imported')
+        self.assertEqual(post.comment_count, 1)
+        self.assertEqual((writer.stats.posts_count, writer.stats.followers_count), (2, 1))
+        self.assertEqual(Timeline.objects.filter(user=self.user).count(), 2)
+        response = self.client_logined.get(reverse('follow_index'))
+        self.assertEqual(len(response.context['page']), 2)
+        response = self.client.get(reverse('search'), {'q': 'импортированный'})
+        self.assertEqual(list(response.context['page']), [post])
+
+    def test_bad_row_is_reported(self):
+        path = self.write_jsonl([{'type': 'post', 'author': 'nobody', 'text': 'x', 'pub_date': '2019-05-01T10:00'}])
+        with self.assertRaisesMessage(CommandError, 'nobody'):
+            call_command('import_content', path, stdout=StringIO())
+
+    def test_export_round_trip(self):
+        post = Post.objects.create(text=TEST_POST_TEXT, author=self.user, group=self.group, image=make_png((10, 10)))
+        Comment.objects.create(post=post, author=self.user, text=TEST_POST_EDIT_TEXT)
+        self.assertEqual(self.client.get(reverse('export')).status_code, 302)
+
+        response = self.client_logined.get(reverse('export'))
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([row['type'] for row in rows], ['user', 'group', 'post', 'comment'])
+        self.assertEqual(rows[2]['image'], post.image.name)
+
+        response = self.client_logined.get(reverse('export'), {'format': 'zip'})
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        with zipfile.ZipFile(BytesIO(b''.join(response.streaming_content))) as archive:
+            self.assertEqual(archive.namelist(), ['content.jsonl', f'images/{post.image.name}'])
+            self.assertEqual(archive.read(f'images/{post.image.name}'), post.image.read())
+
+        # выгрузку можно загрузить обратно: в чистую базу она ляжет теми же строками
+        path = self.write_jsonl(rows)
+        Post.objects.all().delete()
+        call_command('import_content', path, stdout=StringIO())
+        self.assertEqual(Post.objects.get().comment_count, 1)
+        # и рядом с теми же постами: id из файла не совпадают с id в базе
+        call_command('import_content', path, stdout=StringIO())
+        self.assertEqual([post.comment_count for post in Post.objects.all()], [1, 1])
+
+    def test_foreign_comments_exported_and_skipped_on_import(self):
+        other = User.objects.create_user(username='other', password='1235678')
+        foreign = Post.objects.create(text=TEST_POST_TEXT, author=other)
+        Comment.objects.create(post=foreign, author=self.user, text='к чужому посту')
+        first, second = (Post.objects.create(text=f'архивный пост {i}', author=self.user) for i in range(2))
+        for post in (second, first, second):
+            Comment.objects.create(post=post, author=self.user, text=f'к посту {post.pk}')
+        response = self.client_logined.get(reverse('export'))
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        # свои комментарии — сразу за своим постом, к чужим — в конце
+        self.assertEqual([(row['type'], row.get('post', row.get('id'))) for row in rows[1:]], [
+            ('post', first.pk), ('comment', first.pk),
+            ('post', second.pk), ('comment', second.pk), ('comment', second.pk),
+            ('comment', foreign.pk),
+        ])
+
+        counts = importer.Importer(batch_size=1).load(rows)
+        self.assertEqual((counts['post'], counts['comment'], counts['skipped']), (2, 3, 1))
+        imported = Post.objects.exclude(pk__in=[foreign.pk, first.pk, second.pk])
+        self.assertEqual(sorted(post.comment_count for post in imported), [1, 2])
+        # поисковый индекс пополнен пачками, без перестройки целиком
+        self.assertEqual(len(self.client.get(reverse('search'), {'q': 'архивный'}).context['page']), 4)
+
+    def test_failed_batch_keeps_earlier_batches_consistent(self):
+        path = self.write_jsonl([
+            {'type': 'user', 'username': 'writer'},
+            {'type': 'post', 'author': 'writer', 'text': 'первый', 'pub_date': '2019-05-01T10:00:00+00:00'},
+            {'type': 'post', 'author': 'writer', 'text': None, 'pub_date': '2019-05-02T10:00:00+00:00'},
+        ])
+        with self.assertRaisesMessage(CommandError, 'строка 3'):
+            call_command('import_content', path, '--batch-size', '1', stdout=StringIO())
+        writer = User.objects.get(username='writer')
+        self.assertEqual(writer.stats.posts_count, 1)
+        response = self.client.get(reverse('search'), {'q': 'первый'})
+        self.assertEqual(len(response.context['page']), 1)
+
+
+class TestSeedAndBenchmark(CommonTests):
+    def test_seed_load_has_skewed_followers(self):
+        call_command('seed_load', users=60, groups=3, posts=300, comments=200, follows=5, stdout=StringIO())
+        self.assertEqual(Post.objects.filter(author__username__startswith='load').count(), 300)
+        followers = list(UserStats.objects.order_by('-followers_count').values_list('followers_count', flat=True))
+        # у самого популярного автора подписчиков намного больше, чем у типичного
+        self.assertGreater(followers[0], 4 * followers[len(followers) // 2])
+        self.assertEqual(Timeline.objects.filter(post__author__username='load0').count(),
+                         Follow.objects.filter(author__username='load0').count() * Post.objects.filter(
+                             author__username='load0').count())
+
+    def test_benchmark_covers_every_route(self):
+        call_command('seed_load', users=20, groups=2, posts=50, comments=20, follows=3, stdout=StringIO())
+        report = benchmark.run(repeat=2, warmup=0)
+        names = {pattern.name for pattern in benchmark.urls.urlpatterns}
+        self.assertEqual(names - set(report['results']) - set(report['skipped']), set())
+        for name, result in report['results'].items():
+            self.assertEqual(result['status'], [200], msg=name)
+            self.assertLessEqual(result['p50_ms'], result['p95_ms'], msg=name)
+        slower = {'results': {name: dict(result, queries=result['queries'] + 1)
+                              for name, result in report['results'].items()}}
+        self.assertEqual(benchmark.compare(report, slower, 0.2), [])
+        self.assertTrue(benchmark.compare(slower, report, 0.2))
+
+
+@override_settings(POST_THUMBNAIL_WORKERS=0, LIVE_FEED_ENABLED=True, EVENTS_STREAM_SECONDS=0, EVENTS_KEEPALIVE_SECONDS=0)
+class TestQueryBudgets(CommonTests):
+    """
+    Бюджеты SQL-запросов всех представлений на холодном кеше. Они не зависят
+    ни от размера страницы, ни от объёма данных: запрос на каждую запись
+    страницы (N+1) сразу выйдет за бюджет. Для вошедшего пользователя к
+    бюджету добавляются чтение сессии и пользователя.
+    """
+    PAGE_SIZES = (5, 10, 25)
+    VOLUMES = (0.5, 3)  # записей относительно размера страницы
+    AUTH = 2
+
+    def setUp(self):
+        super().setUp()
+        self.author = User.objects.create_user(username='author', password='1235678')
+        Follow.objects.create(user=self.user, author=self.author)
+        User.objects.filter(pk=self.user.pk).update(is_staff=True)  # для /metrics/
+
+    def assertMaxQueries(self, budget, label):
+        return _QueryBudget(self, budget, label)
+
+    def add_posts(self, count):
+        for i in range(count):
+            # у каждого третьего поста картинка, у каждого второго комментарий
+            image = make_png((i % 7 + 1, 3)) if i % 3 == 0 else None
+            post = Post.objects.create(text=f'слово {i}', author=self.author, group=self.group, image=image)
+            if i % 2:
+                Comment.objects.create(post=post, author=self.user, text=TEST_POST_EDIT_TEXT)
+        post = Post.objects.exclude(image='').filter(image_variants='').first()
+        if post is not None:
+            thumbnails.save_variants(post.pk, post.image.name, thumbnails.build_variants(post.image.name))
+        self.post = Post.objects.order_by('-comment_count', '-pk').first()
+
+    def get(self, client, url, budget, label, **params):
+        cache.clear()
+        with self.assertMaxQueries(budget, label):
+            response = client.get(url, params)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        self.assertLess(response.status_code, 500)
+
+    def check_reads(self, label):
+        author, post = self.author.username, self.post.pk
+        anonymous = {
+            reverse('index'): 2,
+            reverse('group', kwargs={'slug': self.group.slug}): 3,
+            reverse('profile', kwargs={'username': author}): 3,
+            reverse('post', kwargs={'username': author, 'post_id': post}): 3,
+            reverse('search'): 3,
+            reverse('feed_events'): 0,
+            reverse('api_index'): 1,
+            reverse('api_group', kwargs={'slug': self.group.slug}): 2,
+            reverse('api_profile', kwargs={'username': author}): 2,
+            reverse('api_post', kwargs={'post_id': post}): 1,
+            reverse('api_comments', kwargs={'post_id': post}): 2,
+            reverse('autocomplete'): 1,
+            reverse('signup'): 0,
+            reverse('metrics'): 0,
+            '/missing-page/': 2,
+        }
+        logined = {
+            reverse('index'): 2,
+            reverse('follow_index'): 3,
+            reverse('feed_events') + '?feed=follow': 0,
+            reverse('api_follow_index'): 2,
+            reverse('new'): 1,
+            reverse('post_edit', kwargs={'username': author, 'post_id': post}): 3,
+            reverse('export'): 4,
+            reverse('metrics'): 0,
+        }
+        for url, budget in anonymous.items():
+            self.get(self.client, url, budget, f'{label} {url}', q='сло')
+        for url, budget in logined.items():
+            self.get(self.client_logined, url, budget + self.AUTH, f'{label} {url} (вошедший)', q='сло')
+
+    def test_read_budgets(self):
+        total = 0
+        for per_page in self.PAGE_SIZES:
+            for volume in self.VOLUMES:
+                total = max(total, int(per_page * volume))
+                self.add_posts(total - Post.objects.count())
+                with self.subTest(per_page=per_page, posts=total), override_settings(POSTS_PER_PAGE=per_page):
+                    self.check_reads(f'[по {per_page}, постов {total}]')
+
+    def send(self, client, url, data, budget, label):
+        cache.clear()
+        with self.assertMaxQueries(budget, label):
+            response = client.post(url, data)
+        self.assertLess(response.status_code, 400)
+
+    def test_write_budgets(self):
+        for volume in (1, 30):
+            self.add_posts(volume - Post.objects.count())
+            author, post = self.author.username, self.post.pk
+            label = f'[постов {volume}]'
+            with self.subTest(posts=volume):
+                self.send(self.client_logined, reverse('new'), {'text': TEST_POST_TEXT, 'group': self.group.pk},
+                          12 + self.AUTH, f'{label} новый пост')
+                self.send(self.client_logined, reverse('add_comment', kwargs={'username': author, 'post_id': post}),
+                          {'text': TEST_POST_EDIT_TEXT}, 7 + self.AUTH, f'{label} комментарий')
+                self.get(self.client_logined, reverse('profile_unfollow', kwargs={'username': author}),
+                         6 + self.AUTH, f'{label} отписка')
+                self.get(self.client_logined, reverse('profile_follow', kwargs={'username': author}),
+                         10 + self.AUTH, f'{label} подписка')
+                self.get(self.client_logined, reverse('profile_follow', kwargs={'username': author}),
+                         5 + self.AUTH, f'{label} повторная подписка')
+                self.client.force_login(self.author)
+                self.send(self.client, reverse('post_edit', kwargs={'username': author, 'post_id': post}),
+                          {'text': TEST_POST_EDIT_TEXT, 'group': self.group.pk}, 10 + self.AUTH,
+                          f'{label} правка поста')
+                self.client.logout()
+                self.send(self.client, reverse('signup'), {
+                    'username': f'new{volume}', 'password1': 'Zx12!qwerty', 'password2': 'Zx12!qwerty',
+                }, 6, f'{label} регистрация')
+
+
+class _QueryBudget(CaptureQueriesContext):
+    """Как assertNumQueries, но «не больше» и с пронумерованными запросами в отчёте"""
+
+    def __init__(self, test, budget, label):
+        super().__init__(connection)
+        self.test, self.budget, self.label = test, budget, label
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        super().__exit__(exc_type, exc_value, traceback)
+        if exc_type is not None or len(self) <= self.budget:
+            return
+        queries = '\n'.join(f'{i}. {query["sql"]}' for i, query in enumerate(self.captured_queries, 1))
+        self.test.fail(f'{self.label}: {len(self)} запросов при бюджете {self.budget}:\n{queries}')
+
+
+class TestRequestMetrics(CommonTests):
+    def setUp(self):
+        super().setUp()
+        metrics.reset()
+
+    def test_server_timing(self):
+        Post.objects.create(text=TEST_POST_TEXT, author=self.user, group=self.group)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('index'))
+        timing = response['Server-Timing']
+        self.assertIn(f'desc="SQL x{len(queries)}"', timing)
+        self.assertIn('tpl;dur=', timing)
+        self.assertIn('total;dur=', timing)
+        # вторая страница берётся из кеша целиком, без базы
+        timing = self.client.get(reverse('index'))['Server-Timing']
+        self.assertIn('desc="SQL x0"', timing)
+        self.assertNotIn('hit 0,', timing)
+
+    def test_cache_reads_counted_once(self):
+        stats = metrics._local.stats = metrics.RequestStats()
+        try:
+            cache.set('metrics:a', 1)
+            self.assertEqual(cache.get('metrics:a'), 1)
+            self.assertEqual(cache.get('metrics:b', 'нет'), 'нет')
+            self.assertEqual(cache.get_many(['metrics:a', 'metrics:b', 'metrics:c']), {'metrics:a': 1})
+        finally:
+            metrics._local.stats = None
+        self.assertEqual((stats.hits, stats.misses), (2, 3))
+
+    def test_metrics_for_staff_only(self):
+        self.client.get(reverse('index'))
+        self.client.get(reverse('index'))
+        self.client_logined.get(reverse('profile', kwargs={'username': self.user.username}))
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        self.assertEqual(self.client_logined.get(reverse('metrics')).status_code, 403)
+        User.objects.filter(pk=self.user.pk).update(is_staff=True)
+        response = self.client_logined.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        text = response.content.decode()
+        self.assertIn('yatube_requests_total{view="index",status="2xx"} 2', text)
+        self.assertIn('yatube_request_duration_seconds_bucket{view="index",le="+Inf"} 2', text)
+        self.assertIn('yatube_request_duration_seconds_count{view="profile"} 1', text)
+        self.assertIn('yatube_request_queries_bucket{view="profile",le="+Inf"} 1', text)
+        self.assertIn('yatube_cache_requests_total{view="index",result="hit"}', text)
+        # корзины накопительные: каждая следующая не меньше предыдущей
+        buckets = [int(line.rsplit(' ', 1)[1]) for line in text.splitlines()
+                   if line.startswith('yatube_request_duration_seconds_bucket{view="index"')]
+        self.assertEqual(buckets, sorted(buckets))
+        self.assertEqual(len(buckets), len(metrics.DURATION_BUCKETS) + 1)
+
+
+@override_settings(SLOW_QUERY_MS=0, SLOW_QUERY_SAMPLE=1.0, SLOW_QUERY_MAX_PER_MINUTE=1000)
+class TestSlowQueryLog(CommonTests):
+    def setUp(self):
+        super().setUp()
+        slowlog._window[:] = [0, 0]
+        handle, self.log = tempfile.mkstemp(suffix='.jsonl')
+        os.close(handle)
+        self.addCleanup(os.remove, self.log)
+        log_setting = override_settings(SLOW_QUERY_LOG=self.log)
+        log_setting.enable()
+        self.addCleanup(log_setting.disable)
+        for i in range(3):
+            Post.objects.create(text=f'{TEST_POST_TEXT} {i}', author=self.user, group=self.group)
+
+    def entries(self):
+        return list(slowlog.read(self.log))
+
+    def test_every_slow_query_logged_with_plan(self):
+        response = self.client.get(reverse('profile', kwargs={'username': self.user.username}))
+        entries = self.entries()
+        # EXPLAIN сам не попадает ни в журнал, ни в счётчик запросов
+        self.assertIn(f'desc="SQL x{len(entries)}"', response['Server-Timing'])
+        self.assertEqual({entry['view'] for entry in entries}, {'profile'})
+        self.assertEqual({entry['path'] for entry in entries}, {f'/{self.user.username}/'})
+        selects = [entry for entry in entries if entry['sql'].startswith('SELECT')]
+        self.assertTrue(selects)
+        for entry in selects:
+            self.assertTrue(entry['plan'], msg=entry['sql'])
+        # параметры — личные данные, по умолчанию их в журнале нет
+        self.assertEqual({entry['params'] for entry in entries}, {None})
+
+    @override_settings(SLOW_QUERY_LOG_PARAMS=True)
+    def test_params_logged_on_request(self):
+        self.client.get(reverse('profile', kwargs={'username': self.user.username}))
+        self.assertTrue(any(self.user.username in entry['params'] for entry in self.entries() if entry['params']))
+
+    def test_sampling_and_rate_limit(self):
+        with override_settings(SLOW_QUERY_SAMPLE=0):
+            self.client.get(reverse('index'))
+        self.assertEqual(self.entries(), [])
+        with override_settings(SLOW_QUERY_MAX_PER_MINUTE=2):
+            self.client.get(reverse('profile', kwargs={'username': self.user.username}))
+        self.assertEqual(len(self.entries()), 2)
+
+    def test_threshold(self):
+        with override_settings(SLOW_QUERY_MS=10 * 1000):
+            self.client.get(reverse('index'))
+        with override_settings(SLOW_QUERY_MS=None):
+            cache.clear()
+            self.client.get(reverse('index'))
+        self.assertEqual(self.entries(), [])
+
+    def test_summary_groups_by_fingerprint(self):
+        for post in Post.objects.all():
+            self.client.get(reverse('api_post', kwargs={'post_id': post.pk}))
+        self.assertEqual(slowlog.fingerprint('SELECT 1 FROM t WHERE a IN (%s, %s) AND b = \'x\'')[1],
+                         'SELECT ? FROM t WHERE a IN (%s...) AND b = ?')
+        out = StringIO()
+        call_command('slow_queries', json=True, view='api_post', stdout=out)
+        summary = json.loads(out.getvalue())
+        self.assertEqual(sum(group['count'] for group in summary), len(self.entries()))
+        self.assertEqual(max(group['count'] for group in summary), 3)
+        self.assertEqual(summary, sorted(summary, key=lambda group: -group['total_ms']))
+        out = StringIO()
+        call_command('slow_queries', top=1, stdout=out)
+        self.assertIn('план:', out.getvalue())
+        with self.assertRaises(CommandError):
+            call_command('slow_queries', log=self.log + '.missing', stdout=StringIO())
+
+
+@skipUnless(connection.vendor == 'sqlite', 'планы запросов проверяются для SQLite')
+class TestQueryPlans(CommonTests):
+    """Каждый запрос ленты идёт по индексу и не сортирует во временном B-дереве"""
+    TABLES = ('"posts_post"', '"posts_timeline"', '"posts_comment"')
+
+    def setUp(self):
+        super().setUp()
+        self.author = User.objects.create_user(username='author', password='1235678')
+        Follow.objects.create(user=self.user, author=self.author)
+        for i in range(30):
+            post = Post.objects.create(text=f'{TEST_POST_TEXT} {i}', author=self.author,
+                                       group=self.group if i % 2 else None)
+        for i in range(15):
+            Comment.objects.create(post=post, author=self.user, text=f'{TEST_POST_EDIT_TEXT} {i}')
+        self.post = post
+
+    def feed_queries(self, client, url):
+        """SQL выборок постов, ленты и комментариев, которые делает страница"""
+        urls = [url]
+        response = client.get(url)
+        cursor = response.json().get('next') if response['Content-Type'] == 'application/json' else None
+        page = response.context['page'] if response.context and 'page' in response.context else None
+        if page is not None and page.next_cursor():
+            cursor = page.next_cursor()
+        if cursor:
+            urls.append(f'{url}?after={cursor}')  # и страница по курсору
+        queries = []
+        for url in urls:
+            cache.clear()
+            with CaptureQueriesContext(connection) as captured:
+                client.get(url)
+            queries += [
+                query['sql'] for query in captured.captured_queries
+                if query['sql'].startswith('SELECT') and 'ORDER BY' in query['sql']
+                and any(f'FROM {table}' in query['sql'] for table in self.TABLES)
+            ]
+        self.assertTrue(queries, msg=url)
+        return queries
+
+    def plan(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            return [row[-1] for row in cursor.fetchall()]
+
+    def test_feeds_use_indexes(self):
+        author, group = self.author.username, self.group.slug
+        pages = [
+            (self.client, reverse('index')),
+            (self.client, reverse('group', kwargs={'slug': group})),
+            (self.client, reverse('profile', kwargs={'username': author})),
+            (self.client, reverse('post', kwargs={'username': author, 'post_id': self.post.pk})),
+            (self.client_logined, reverse('follow_index')),
+            (self.client, reverse('api_index')),
+            (self.client, reverse('api_group', kwargs={'slug': group})),
+            (self.client, reverse('api_profile', kwargs={'username': author})),
+            (self.client, reverse('api_comments', kwargs={'post_id': self.post.pk})),
+            (self.client_logined, reverse('api_follow_index')),
+        ]
+        with override_settings(POSTS_PER_PAGE=5):
+            for client, url in pages:
+                for sql in self.feed_queries(client, url):
+                    plan = self.plan(sql)
+                    with self.subTest(url=url, sql=sql):
+                        self.assertFalse([line for line in plan if 'TEMP B-TREE' in line], msg=plan)
+                        for line in plan:
+                            if line.startswith(('SCAN', 'SEARCH')):
+                                self.assertIn('USING', line, msg=plan)
+
+    def test_follow_check_uses_unique_index(self):
+        with CaptureQueriesContext(connection) as captured:
+            is_not_folower(self.user, self.author)
+        plan = self.plan(captured[0]['sql'])
+        self.assertTrue(plan[0].startswith('SEARCH') and 'INDEX' in plan[0], msg=plan)
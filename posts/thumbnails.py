@@ -0,0 +1,310 @@
+"""
+Миниатюры картинок постов готовятся заранее, в пуле процессов, сразу после
+сохранения поста. Страницы только ищут готовую миниатюру в KVStore
+sorl-thumbnail и, пока её нет, показывают исходную картинку — чтение ленты
+никогда не ждёт декодирования и масштабирования.
+
+Там же строятся адаптивные варианты картинки (несколько ширин, WebP, если
+Pillow его умеет) и крошечная заглушка; их размеры и адреса сохраняются в
+самом посте, и карточке для srcset больше ничего не нужно.
+"""
+import base64
+import io
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from PIL import Image, ImageOps, features
+from sorl.thumbnail import default, delete as delete_thumbnails, get_thumbnail
+from sorl.thumbnail.conf import defaults as default_settings
+from sorl.thumbnail.conf import settings as thumbnail_settings
+from sorl.thumbnail.images import ImageFile, deserialize_image_file
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.kvstores.cached_db_kvstore import EMPTY_VALUE, KVStore as CachedDbKVStore
+from sorl.thumbnail.models import KVStore as KVStoreModel
+
+from . import versions
+from .lru import LRUCache
+from .models import Post
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_pending = set()  # имена, уже отправленные в пул этим процессом
+_lock = threading.Lock()
+# готовые миниатюры не меняются, поэтому найденные держим и в памяти процесса
+_found = LRUCache(settings.POST_THUMBNAIL_LRU_SIZE)
+
+
+def _options(source, options):
+    # те же умолчания, что в ThumbnailBackend.get_thumbnail: от них зависит имя файла
+    backend = default.backend
+    options = dict(options)
+    if thumbnail_settings.THUMBNAIL_PRESERVE_FORMAT:
+        options.setdefault('format', backend._get_format(source))
+    for key, value in backend.default_options.items():
+        options.setdefault(key, value)
+    for key, attr in backend.extra_options:
+        value = getattr(thumbnail_settings, attr)
+        if value != getattr(default_settings, attr):
+            options.setdefault(key, value)
+    return options
+
+
+def _raw_key(file_, geometry, options):
+    source = ImageFile(file_)
+    name = default.backend._get_thumbnail_filename(source, geometry, _options(source, options))
+    return add_prefix(ImageFile(name, default.storage).key)
+
+
+def _get_many_raw(raw_keys):
+    kvstore = default.kvstore
+    if not isinstance(kvstore, CachedDbKVStore):
+        return {key: kvstore._get_raw(key) for key in raw_keys}
+    # как KVStore._get_raw, но пачкой: один get_many к кешу и один запрос к базе
+    found = kvstore.cache.get_many(raw_keys)
+    missing = [key for key in raw_keys if key not in found]
+    if missing:
+        rows = dict(KVStoreModel.objects.filter(key__in=missing).values_list('key', 'value'))
+        kvstore.cache.set_many(rows, thumbnail_settings.THUMBNAIL_CACHE_TIMEOUT)
+        # промах — ненадолго: миниатюру, вероятно, как раз делает пул
+        kvstore.cache.set_many(
+            {key: EMPTY_VALUE for key in missing if key not in rows}, settings.POST_THUMBNAIL_MISS_TIMEOUT
+        )
+        found.update(rows)
+    return {key: value for key, value in found.items() if value and value != EMPTY_VALUE}
+
+
+def lookup_many(files, geometry, **options):
+    """Готовые миниатюры для многих картинок сразу: {имя картинки: миниатюра или None}."""
+    keys = {file_.name: _raw_key(file_, geometry, options) for file_ in files}
+    result = {name: _found.get(key) for name, key in keys.items()}
+    missing = [key for name, key in keys.items() if result[name] is None]
+    if missing:
+        raw = _get_many_raw(missing)
+        for name, key in keys.items():
+            if key in raw:
+                result[name] = deserialize_image_file(raw[key])
+                _found.set(key, result[name])
+    return result
+
+
+def cached(file_, geometry, **options):
+    """Готовая миниатюра или None; сама миниатюра здесь не создаётся."""
+    return lookup_many([file_], geometry, **options)[file_.name]
+
+
+def forget():
+    """Сбросить найденные миниатюры в памяти процесса"""
+    _found.clear()
+
+
+def options_key(geometry, options):
+    return geometry, tuple(sorted(options.items()))
+
+
+def prefetch(posts, geometries=None):
+    """
+    Находит миниатюры для всех постов страницы разом и оставляет их в постах,
+    тегу post_thumbnail остаётся только взять готовое. Посты с вариантами
+    картинки (image_variants) миниатюр не используют и пропускаются.
+    """
+    posts = [post for post in posts if post.image and not post.variants]
+    if not posts:
+        return
+    for geometry, options in geometries or settings.POST_THUMBNAILS:
+        found = lookup_many([post.image for post in posts], geometry, **options)
+        for post in posts:
+            post.__dict__.setdefault('prefetched_thumbnails', {})[
+                options_key(geometry, options)
+            ] = found[post.image.name]
+
+
+def _source(name):
+    # ключи sorl-thumbnail зависят от хранилища, поэтому берём хранилище поля
+    return ImageFile(name, Post._meta.get_field('image').storage)
+
+
+def generate(name, geometries=None):
+    for geometry, options in geometries or settings.POST_THUMBNAILS:
+        try:
+            get_thumbnail(_source(name), geometry, **options)
+        except Exception:
+            logger.exception('Не удалось сделать миниатюру %s для %s', geometry, name)
+
+
+def _variant_format():
+    return ('WEBP', 'webp', 'image/webp') if features.check('webp') else ('JPEG', 'jpg', 'image/jpeg')
+
+
+def _encode(image, format_, quality):
+    if format_ == 'JPEG' or 'A' not in image.getbands():
+        image = image.convert('RGB')
+    else:
+        image = image.convert('RGBA')
+    buffer = io.BytesIO()
+    image.save(buffer, format_, quality=quality)
+    return buffer.getvalue()
+
+
+def build_variants(name):
+    """
+    Делает варианты картинки и возвращает поля поста для них. Выполняется
+    в процессе пула, поэтому база здесь не трогается.
+    """
+    with _source(name).storage.open(name) as file_, Image.open(file_) as original:
+        image = ImageOps.exif_transpose(original)
+        image.load()
+    width, height = image.size
+    format_, extension, mime = _variant_format()
+    stem = os.path.splitext(os.path.basename(name))[0]
+    widths = [w for w in settings.POST_IMAGE_WIDTHS if w < width] + [
+        min(width, max(settings.POST_IMAGE_WIDTHS))
+    ]
+    variants = []
+    for target in widths:
+        size = (target, max(1, round(height * target / width)))
+        saved = f'posts/variants/{stem}-{target}.{extension}'
+        # имя картинки — хеш содержимого, так что готовый вариант можно не пересчитывать
+        if not default_storage.exists(saved):
+            data = _encode(image.resize(size, Image.LANCZOS), format_, settings.POST_IMAGE_QUALITY)
+            saved = default_storage.save(saved, ContentFile(data))
+        variants.append({'url': default_storage.url(saved), 'name': saved,
+                         'width': size[0], 'height': size[1], 'type': mime})
+    tiny = image.copy()
+    tiny.thumbnail((16, 16))
+    placeholder = 'data:image/jpeg;base64,' + base64.b64encode(_encode(tiny, 'JPEG', 40)).decode()
+    return {'image_width': width, 'image_height': height,
+            'image_placeholder': placeholder, 'image_variants': json.dumps(variants)}
+
+
+def save_variants(post_id, name, fields):
+    # пока строились варианты, картинку могли заменить — тогда они не нужны
+    post = Post.objects.filter(pk=post_id, image=name).values_list('author_id', 'group_id').first()
+    if post is None:
+        return
+    Post.objects.filter(pk=post_id, image=name).update(**fields)
+    versions.bump(*versions.post_scopes(post_id, *post))
+
+
+def _init_worker():
+    import django
+    from django.apps import apps
+    if not apps.ready:  # процесс запущен через spawn
+        django.setup()
+    # при fork процесс наследует соединения родителя, пользоваться ими нельзя
+    connections.close_all()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=settings.POST_THUMBNAIL_WORKERS, initializer=_init_worker)
+    return _executor
+
+
+def _done(name):
+    def callback(future):
+        with _lock:
+            _pending.discard(name)
+        if future.exception() is not None:
+            logger.error('Пул миниатюр не обработал %s: %s', name, future.exception())
+    return callback
+
+
+def submit(name, geometries=None):
+    if not settings.POST_THUMBNAIL_WORKERS:
+        generate(name, geometries)
+        return
+    with _lock:
+        # одна картинка, открытая сразу многими читателями, ставится в очередь один раз
+        if name in _pending:
+            return
+        _pending.add(name)
+    geometries = list(geometries or settings.POST_THUMBNAILS)
+    _get_executor().submit(generate, name, geometries).add_done_callback(_done(name))
+
+
+def _variants_done(post_id, name):
+    def callback(future):
+        try:
+            save_variants(post_id, name, future.result())
+        except Exception:
+            logger.exception('Не удалось сделать варианты картинки %s', name)
+        finally:
+            connections.close_all()  # колбэк выполняется в служебном потоке пула
+    return callback
+
+
+VARIANT_FIELDS = ('image_width', 'image_height', 'image_placeholder', 'image_variants')
+
+
+def submit_variants(post_id, name):
+    # та же картинка уже есть у другого поста: варианты берём у него
+    existing = Post.objects.filter(image=name).exclude(image_variants='').values(*VARIANT_FIELDS).first()
+    if existing is not None:
+        save_variants(post_id, name, existing)
+        return
+    if not settings.POST_THUMBNAIL_WORKERS:
+        try:
+            save_variants(post_id, name, build_variants(name))
+        except Exception:
+            logger.exception('Не удалось сделать варианты картинки %s', name)
+        return
+    _get_executor().submit(build_variants, name).add_done_callback(_variants_done(post_id, name))
+
+
+def schedule_variants(post):
+    """Поставить в очередь адаптивные варианты картинки поста после коммита."""
+    if post.image:
+        post_id, name = post.pk, post.image.name
+        transaction.on_commit(lambda: submit_variants(post_id, name))
+
+
+def schedule(image, geometries=None):
+    """Поставить миниатюры картинки в очередь после коммита транзакции."""
+    if image:
+        name = image.name
+        transaction.on_commit(lambda: submit(name, geometries))
+
+
+def _recently_saved(name):
+    try:
+        age = time.time() - os.path.getmtime(default_storage.path(name))
+    except (OSError, NotImplementedError, SuspiciousFileOperation):
+        return False
+    return age < settings.POST_IMAGE_RELEASE_GRACE
+
+
+def _release(name, variants):
+    # проверка ссылок и удаление не атомарны: ту же картинку могли загрузить
+    # в пост, ещё не закоммиченный, — ContentAddressedStorage тогда обновила
+    # время изменения файла, и такой файл не трогаем
+    if Post.objects.filter(image=name).exists() or _recently_saved(name):
+        return
+    _found.clear()  # удалённые миниатюры не должны находиться в памяти процесса
+    try:
+        delete_thumbnails(_source(name))  # сам файл, его миниатюры и записи о них в KVStore
+        for variant in variants:
+            default_storage.delete(variant)
+    except SuspiciousFileOperation:
+        logger.warning('Картинка %s лежит вне MEDIA_ROOT, не удаляем', name)
+
+
+def release_image(name, variants=()):
+    """
+    Картинка больше не нужна посту. Если после коммита на неё не ссылается
+    ни один пост и её не загружали последние POST_IMAGE_RELEASE_GRACE
+    секунд, удаляются файл, миниатюры и варианты.
+    """
+    if name:
+        variants = [variant['name'] for variant in variants]
+        transaction.on_commit(lambda: _release(name, variants))
@@ -0,0 +1,136 @@
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+
+from . import versions
+from .models import Follow, Post, Timeline, UserStats
+from .paginator import CursorPaginator
+
+BATCH_SIZE = 500
+ORDERING = ('-pub_date', '-post_id')
+
+
+def is_pulled(author_id):
+    # посты популярных авторов не раскладываются по лентам, а читаются при показе
+    return UserStats.objects.filter(
+        Q(timeline_pulled=True) | Q(followers_count__gt=settings.TIMELINE_FANOUT_MAX_FOLLOWERS),
+        pk=author_id,
+    ).exists()
+
+
+def pull_if_popular(author_id):
+    """
+    is_pulled для тех, кто собирается пропустить раскладку. Пропуск
+    запоминается насовсем: если подписчиков потом станет меньше порога,
+    пропущенных постов в лентах всё равно нет, и их по-прежнему надо
+    подмешивать при чтении.
+    """
+    UserStats.objects.filter(
+        pk=author_id, followers_count__gt=settings.TIMELINE_FANOUT_MAX_FOLLOWERS, timeline_pulled=False
+    ).update(timeline_pulled=True)
+    return is_pulled(author_id)
+
+
+def followed_authors(user):
+    """Пары (автор, читаются ли его посты при показе) для всех подписок пользователя."""
+    limit = settings.TIMELINE_FANOUT_MAX_FOLLOWERS
+    rows = Follow.objects.filter(user=user).values_list(
+        'author_id', 'author__stats__timeline_pulled', 'author__stats__followers_count'
+    )
+    return [
+        (author_id, bool(pulled) or (followers is not None and followers > limit))
+        for author_id, pulled, followers in rows
+    ]
+
+
+def fan_out(post):
+    # новый пост раскладывается в ленты всех подписчиков автора
+    if pull_if_popular(post.author_id):
+        return
+    followers = Follow.objects.filter(author_id=post.author_id).values_list('user_id', flat=True)
+    batch = []
+    for user_id in followers.iterator():
+        batch.append(Timeline(user_id=user_id, post=post, pub_date=post.pub_date))
+        if len(batch) >= BATCH_SIZE:
+            _write(batch)
+            batch = []
+    _write(batch)
+
+
+def _write(batch):
+    Timeline.objects.bulk_create(batch, ignore_conflicts=True)
+    versions.bump(*(f'timeline:{entry.user_id}' for entry in batch))
+
+
+def backfill(user_id, author_id):
+    # при подписке в ленту попадают последние посты автора
+    versions.bump(f'timeline:{user_id}')
+    if pull_if_popular(author_id):
+        return
+    limit = settings.TIMELINE_BACKFILL_LIMIT
+    posts = Post.objects.filter(author_id=author_id).order_by('-pub_date').values_list('pk', 'pub_date')
+    Timeline.objects.bulk_create(
+        (Timeline(user_id=user_id, post_id=pk, pub_date=pub_date) for pk, pub_date in posts[:limit]),
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+def rebuild_authors(author_ids):
+    """
+    То же, что backfill для всех подписчиков этих авторов, но одним
+    INSERT ... SELECT на автора, без моделей в памяти, — для массовой
+    загрузки, где строк ленты сотни тысяч.
+    """
+    ops = connection.ops
+    table, follow, post = (ops.quote_name(model._meta.db_table) for model in (Timeline, Follow, Post))
+    sql = (
+        f"{ops.insert_statement(ignore_conflicts=True)} {table} (user_id, post_id, pub_date) "
+        f"SELECT f.user_id, p.id, p.pub_date FROM {follow} f, {post} p "
+        f"WHERE f.author_id = %s AND p.id IN ("
+        f"SELECT id FROM {post} WHERE author_id = %s ORDER BY pub_date DESC LIMIT %s) "
+        f"{ops.ignore_conflicts_suffix_sql(ignore_conflicts=True)}"
+    )
+    for author_id in author_ids:
+        followers = list(Follow.objects.filter(author_id=author_id).values_list('user_id', flat=True))
+        if not followers:
+            continue
+        versions.bump(*(f'timeline:{user_id}' for user_id in followers))
+        if pull_if_popular(author_id):
+            continue
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [author_id, author_id, settings.TIMELINE_BACKFILL_LIMIT])
+
+
+def trim(user_id, author_id):
+    Timeline.objects.filter(user_id=user_id, post__author_id=author_id).delete()
+    versions.bump(f'timeline:{user_id}')
+
+
+def entries_to_posts(entries):
+    return [entry.post for entry in entries]
+
+
+def feed(user):
+    return Timeline.objects.filter(user=user).select_related('post__author', 'post__group')
+
+
+def version(user, followed):
+    """
+    Версия ленты для ключа кеша: версия раскладки, имён и всех авторов, на
+    которых подписан пользователь (их меняют правки постов и комментарии).
+    """
+    return versions.combined(f'timeline:{user.pk}', 'names', *(f'author:{author_id}' for author_id, _ in followed))
+
+
+def paginator(user, per_page, followed):
+    """
+    Лента подписок: разложенные строки Timeline, слитые с отдельными
+    отсортированными потоками постов каждого популярного автора.
+    """
+    streams = [
+        CursorPaginator(Post.objects.feed().filter(author_id=author_id), per_page)
+        for author_id, pulled in followed
+        if pulled
+    ]
+    return CursorPaginator(feed(user), per_page, ordering=ORDERING, transform=entries_to_posts, streams=streams)
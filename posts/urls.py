@@ -1,11 +1,22 @@
 from django.urls import path
-from . import views
+from . import api, views
 
 urlpatterns = [
     path("", views.index, name="index"),
     path("group/<str:slug>", views.group_posts, name="group"),
     path("new/", views.new_post, name='new'),
     path("follow/", views.follow_index, name="follow_index"),
+    path("search/", views.search_posts, name="search"),
+    path("events/", views.feed_events, name="feed_events"),
+    path("export/", views.export_content, name="export"),
+    path("metrics/", views.prometheus_metrics, name="metrics"),
+    # JSON API только для чтения
+    path("api/posts/", api.index, name="api_index"),
+    path("api/posts/<int:post_id>/", api.post_detail, name="api_post"),
+    path("api/posts/<int:post_id>/comments/", api.post_comments, name="api_comments"),
+    path("api/group/<str:slug>/", api.group_posts, name="api_group"),
+    path("api/users/<str:username>/posts/", api.profile_posts, name="api_profile"),
+    path("api/follow/", api.follow_index, name="api_follow_index"),
     # Профайл пользователя
     path('<str:username>/', views.profile, name='profile'),
     # Просмотр записи
@@ -0,0 +1,64 @@
+"""
+Версии наборов данных для ключей кеша. Версия — отметка времени последнего
+изменения в микросекундах: если запись вытеснят из кеша, новая версия всё
+равно не совпадёт со старой и не оживит устаревшие фрагменты.
+
+Без общего кеша версии живут VERSION_TIMEOUT секунд: сброс в другом
+процессе сюда не доходит, и только истечение версии ограничивает, сколько
+страницы и валидаторы этого процесса остаются устаревшими.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+
+def _key(scope):
+    return f'version:{scope}'
+
+
+def _now():
+    return time.time_ns() // 1000
+
+
+def get(scope):
+    return cache.get_or_set(_key(scope), _now, timeout=settings.VERSION_TIMEOUT)
+
+
+def get_many(scopes):
+    keys = {_key(scope): scope for scope in scopes}
+    found = cache.get_many(keys)
+    missing = {key: _now() for key in keys if key not in found}
+    if missing:
+        cache.set_many(missing, timeout=settings.VERSION_TIMEOUT)
+        found.update(missing)
+    return {keys[key]: value for key, value in found.items()}
+
+
+def _set(scopes):
+    now = _now()
+    cache.set_many({_key(scope): now for scope in scopes}, timeout=settings.VERSION_TIMEOUT)
+
+
+def bump(*scopes):
+    if not scopes:
+        return
+    _set(scopes)
+    if transaction.get_connection().in_atomic_block:
+        # до коммита читатель мог закешировать старые данные под новой версией
+        transaction.on_commit(lambda: _set(scopes))
+
+
+def combined(*scopes):
+    """Одна версия для нескольких областей, например для ключа фрагмента"""
+    found = get_many(scopes)
+    return '.'.join(str(found[scope]) for scope in scopes)
+
+
+def post_scopes(post_id, author_id, group_id):
+    # пост виден на своей странице, в общей ленте, в ленте автора и в ленте группы
+    scopes = [f'post:{post_id}', 'posts', f'author:{author_id}']
+    if group_id is not None:
+        scopes.append(f'group:{group_id}')
+    return scopes
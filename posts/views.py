@@ -1,19 +1,72 @@
-from django.core.paginator import Paginator
+import json
+import queue
+import time
+
+from django.conf import settings
 from django.contrib.auth import get_user
 from django.contrib.auth.decorators import login_required
+from django.db import IntegrityError
+from django.http import Http404, HttpResponse, HttpResponseForbidden, StreamingHttpResponse
 from django.shortcuts import render, get_object_or_404, redirect
 from django.urls import reverse
 from .models import User, Post, Group, Comment, Follow
 from .forms import CommentForm, PostForm
+from .conditional import versioned
+from .paginator import CursorPaginator
+from . import counters, events, export, metrics, pagecache, search, timeline, versions
 
 
 def is_not_folower(user, author):
     if user.is_authenticated:
-        author = get_object_or_404(User, username=author)
-        return Follow.objects.filter(user=user).filter(author=author).count() == 0
+        return not Follow.objects.filter(user=user, author=author).exists()
     return True
 
 
+def paginate(request, post_list=None, paginator=None):
+    # страница выбирается курсорами ?after=/?before=, а не номером страницы
+    if paginator is None:
+        paginator = CursorPaginator(post_list, settings.POSTS_PER_PAGE)
+    page = paginator.get_page(after=request.GET.get('after'), before=request.GET.get('before'))
+    return paginator, page
+
+
+# функции *_scopes вызываются декоратором versioned до представления; найденные
+# объекты они оставляют в request, чтобы представление не искало их повторно
+
+def _profile_user(request, username):
+    request.profile_user = User.objects.select_related('stats').filter(username=username).first()
+    return request.profile_user
+
+
+def index_scopes(request):
+    return ['posts']
+
+
+# названия групп и имена авторов выводятся не только на своих страницах,
+# поэтому их переименование сбрасывает общую область names (см. сигналы)
+
+def group_scopes(request, slug):
+    request.group = Group.objects.filter(slug=slug).first()
+    return None if request.group is None else [f'group:{request.group.pk}', 'names']
+
+
+def profile_scopes(request, username):
+    user = _profile_user(request, username)
+    return None if user is None else [f'author:{user.pk}', f'stats:{user.pk}', 'names']
+
+
+def post_scopes(request, username, post_id):
+    user = _profile_user(request, username)
+    return None if user is None else [f'post:{post_id}', f'stats:{user.pk}', 'names']
+
+
+def follow_scopes(request):
+    request.followed_authors = timeline.followed_authors(request.user)
+    return [f'timeline:{request.user.pk}', 'names'] + [
+        f'author:{author_id}' for author_id, _ in request.followed_authors
+    ]
+
+
 def page_not_found(request, exception):
     # Переменная exception содержит отладочную информацию,
     # выводить её в шаблон пользователской страницы 404 мы не станем
@@ -29,24 +82,34 @@ def server_error(request):
     return render(request, "misc/500.html", status=500)
 
 
+@versioned(index_scopes)
 def index(request):
-    post_list = Post.objects.all()
-    paginator = Paginator(post_list, 10)  # показывать по 10 записей на странице.
-    page_number = request.GET.get('page')  # переменная в URL с номером запрошенной страницы
-    page = paginator.get_page(page_number)  # получить записи с нужным смещением
+    pagecache.tag(request, 'posts')
+    paginator, page = paginate(request, Post.objects.feed())
     return render(
         request,
         'index.html',
-        {'page': page, 'paginator': paginator, "post_count_in_base": post_list.count}
+        {'page': page, 'paginator': paginator, 'feed_version': versions.get('posts')}
     )
 
 
+@versioned(group_scopes)
 def group_posts(request, slug):
-    group = get_object_or_404(Group, slug=slug)
-    paginator = Paginator(group.posts.all(), 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
-    return render(request, "group.html", {"group": group, "page": page, 'paginator': paginator})
+    group = getattr(request, 'group', None) or get_object_or_404(Group, slug=slug)
+    pagecache.tag(request, f'group:{group.pk}', 'names')
+    paginator, page = paginate(request, group.posts.feed())
+    return render(request, "group.html", {"group": group,
+                                          "page": page,
+                                          'paginator': paginator,
+                                          'feed_version': versions.combined(f'group:{group.pk}', 'names'),
+                                          })
+
+
+def search_posts(request):
+    # выдача отсортирована по релевантности, её ключ — позиция в выдаче
+    query = request.GET.get('q', '').strip()
+    paginator, page = paginate(request, paginator=search.SearchPaginator(query, settings.POSTS_PER_PAGE))
+    return render(request, 'search.html', {'query': query, 'page': page, 'paginator': paginator})
 
 
 @login_required
@@ -67,24 +130,33 @@ def new_post(request):
     return render(request, 'new_post.html', {'form': form})
 
 
+@versioned(profile_scopes)
 def profile(request, username):
-    user = get_object_or_404(User, username=username)
-    paginator = Paginator(user.posts.all(), 10)
-    page = paginator.get_page(request.GET.get('page'))
+    user = getattr(request, 'profile_user', None) or get_object_or_404(
+        User.objects.select_related('stats'), username=username
+    )
+    pagecache.tag(request, f'author:{user.pk}', f'stats:{user.pk}', 'names')
+    counters.stats_for(user)
+    paginator, page = paginate(request, user.posts.feed())
     return render(request, 'profile.html',
                   {"profile_user": user,
                    'page': page,
                    'paginator': paginator,
-                   'following': not is_not_folower(request.user, username),
+                   'following': not is_not_folower(request.user, user),
+                   'feed_version': versions.combined(f'author:{user.pk}', 'names'),
                    }
                   )
 
 
+@versioned(post_scopes)
 def post_view(request, username, post_id):
-    user = get_object_or_404(User, username=username)
-    post = get_object_or_404(Post, pk=post_id)
-    post_count = user.posts.all().count
-    comments = post.comments.all()
+    user = getattr(request, 'profile_user', None) or get_object_or_404(
+        User.objects.select_related('stats'), username=username
+    )
+    pagecache.tag(request, f'post:{post_id}', f'stats:{user.pk}', 'names')
+    counters.stats_for(user)
+    post = get_object_or_404(Post.objects.feed(), pk=post_id)
+    comments = post.comments.select_related('author').order_by('created', 'pk')
     commentform = CommentForm()
     return render(request, 'post.html',
                   {"profile_user": user,
@@ -125,16 +197,20 @@ def add_comment(request, username, post_id):
 
 
 @login_required
+@versioned(follow_scopes)
 def follow_index(request):
     # информация о текущем пользователе доступна в переменной request.user
-    post_list = Post.objects.filter(author__following__user=request.user)
-    paginator = Paginator(post_list, 10)  # показывать по 10 записей на странице.
-    page_number = request.GET.get('page')  # переменная в URL с номером запрошенной страницы
-    page = paginator.get_page(page_number)  # получить записи с нужным смещением
+    # лента читается из заранее разложенной таблицы Timeline, без join через Follow
+    followed = getattr(request, 'followed_authors', None)
+    if followed is None:
+        followed = timeline.followed_authors(request.user)
+    paginator, page = paginate(
+        request, paginator=timeline.paginator(request.user, settings.POSTS_PER_PAGE, followed)
+    )
     return render(
         request,
         'follow.html',
-        {'page': page, 'paginator': paginator, "post_count_in_base": post_list.count}
+        {'page': page, 'paginator': paginator, 'feed_version': timeline.version(request.user, followed)}
     )
 
 
@@ -142,9 +218,12 @@ def follow_index(request):
 def profile_follow(request, username):
     author = get_object_or_404(User, username=username)
     if request.user.username != username:  # не подписываем сомого на себя
-        if is_not_folower(request.user, username):
-            follow = Follow(user=request.user, author=author)
-            follow.save()
+        # без проверки заранее: повторную подписку отсечёт уникальный индекс,
+        # и две одновременные подписки не создадут двух строк
+        try:
+            Follow(user=request.user, author=author).save()
+        except IntegrityError:
+            pass
     return redirect(reverse('profile', kwargs={'username': username}))
 
 
@@ -153,3 +232,72 @@ def profile_unfollow(request, username):
     author = get_object_or_404(User, username=username)
     Follow.objects.filter(user=request.user).filter(author=author).delete()
     return redirect(reverse('profile', kwargs={'username': username}))
+
+
+@login_required
+def export_content(request):
+    """Архив своих постов и комментариев: ?format=zip — вместе с картинками"""
+    if request.GET.get('format') == 'zip':
+        chunks, content_type, extension = export.zip_archive(request.user), 'application/zip', 'zip'
+    else:
+        chunks, content_type, extension = export.jsonl(request.user), 'application/x-ndjson', 'jsonl'
+    response = StreamingHttpResponse(chunks, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{request.user.username}.{extension}"'
+    return response
+
+
+def _event_stream(subscriber, authors):
+    try:
+        yield f'retry: {settings.EVENTS_RETRY_MS}\n\n'
+        deadline = time.monotonic() + settings.EVENTS_STREAM_SECONDS
+        while True:
+            left = deadline - time.monotonic()
+            if left <= 0:
+                # поток не держит воркер сервера вечно: клиент переподключится
+                # с Last-Event-ID и получит пропущенное из буфера шины
+                return
+            try:
+                event = subscriber.get(timeout=min(left, settings.EVENTS_KEEPALIVE_SECONDS))
+            except queue.Empty:
+                yield ': keepalive\n\n'
+                continue
+            if authors is not None and event.get('author_id') not in authors:
+                continue
+            if event['type'] == 'post':
+                event = dict(event, url=reverse('post', kwargs={'username': event['author'],
+                                                                'post_id': event['post_id']}))
+            yield f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+    finally:
+        events.unsubscribe(subscriber)
+
+
+def feed_events(request):
+    """
+    Поток Server-Sent Events о новых постах: ?feed=follow — только от авторов,
+    на которых подписан читатель, иначе — все посты общей ленты.
+    """
+    if not settings.LIVE_FEED_ENABLED:
+        raise Http404('Живые ленты выключены (LIVE_FEED_ENABLED)')
+    authors = None
+    if request.GET.get('feed') == 'follow':
+        if not request.user.is_authenticated:
+            # EventSource не пойдёт по редиректу на форму входа
+            return HttpResponseForbidden()
+        authors = {author_id for author_id, _ in timeline.followed_authors(request.user)}
+    try:
+        last_id = int(request.META.get('HTTP_LAST_EVENT_ID', ''))
+    except ValueError:
+        last_id = None
+    response = StreamingHttpResponse(_event_stream(events.subscribe(last_id), authors),
+                                     content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # nginx не должен копить поток в буфере
+    return response
+
+
+def prometheus_metrics(request):
+    """Метрики запросов процесса в формате Prometheus, только для персонала"""
+    if not request.user.is_staff:
+        # сборщик метрик не пойдёт по редиректу на форму входа
+        return HttpResponseForbidden()
+    return HttpResponse(metrics.exposition(), content_type='text/plain; version=0.0.4; charset=utf-8')
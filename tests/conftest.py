@@ -1,4 +1,14 @@
+import pytest
+
 pytest_plugins = [
     'tests.fixtures.fixture_user',
     'tests.fixtures.fixture_data',
 ]
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    # база между тестами очищается без сигналов, поэтому закешированные
+    # страницы сбросом по суррогатным ключам не инвалидируются
+    from django.core.cache import cache
+    cache.clear()
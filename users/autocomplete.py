@@ -0,0 +1,123 @@
+"""
+Подсказки при поиске автора. Индекс — отсортированный в памяти список пар
+(нормализованная строка, id пользователя) по логину, имени и фамилии;
+поиск по префиксу — бинарный поиск и короткий проход вперёд. Сигналы User
+правят индекс своего процесса на месте, а версия в кеше сообщает
+остальным процессам, что их копия устарела и её надо перечитать. Это
+работает, только если кеш общий (см. CACHES в настройках); с кешем
+процесса индекс перечитывается раз в AUTOCOMPLETE_MAX_AGE секунд.
+"""
+import bisect
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+
+VERSION_KEY = 'autocomplete:users:version'
+LIMIT = 10
+MAX_LIMIT = 50
+
+
+def normalize(value):
+    return ' '.join(value.split()).casefold()
+
+
+class PrefixIndex:
+    def __init__(self):
+        self.entries = []   # (строка, логин, id) — логин нужен для устойчивого порядка
+        self.users = {}     # id -> (логин, полное имя, строки в entries)
+        self.version = None
+        self.loaded_at = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _terms(username, first_name, last_name):
+        terms = {normalize(username), normalize(first_name), normalize(last_name),
+                 normalize(f'{first_name} {last_name}')}
+        terms.discard('')
+        return terms
+
+    def _add(self, pk, username, first_name, last_name):
+        terms = self._terms(username, first_name, last_name)
+        self.users[pk] = (username, f'{first_name} {last_name}'.strip(), terms)
+        for term in terms:
+            bisect.insort(self.entries, (term, username, pk))
+
+    def _remove(self, pk):
+        username, _, terms = self.users.pop(pk, (None, None, ()))
+        for term in terms:
+            i = bisect.bisect_left(self.entries, (term, username, pk))
+            if i < len(self.entries) and self.entries[i] == (term, username, pk):
+                del self.entries[i]
+
+    def load(self):
+        version = cache.get_or_set(VERSION_KEY, 0, timeout=None)
+        rows = get_user_model().objects.filter(is_active=True).values_list(
+            'pk', 'username', 'first_name', 'last_name'
+        )
+        entries, users = [], {}
+        for pk, username, first_name, last_name in rows.iterator():
+            terms = self._terms(username, first_name, last_name)
+            users[pk] = (username, f'{first_name} {last_name}'.strip(), terms)
+            entries.extend((term, username, pk) for term in terms)
+        entries.sort()
+        with self.lock:
+            self.entries, self.users, self.version = entries, users, version
+            self.loaded_at = time.monotonic()
+
+    def _bump(self):
+        # свой индекс уже поправлен на месте, перечитывать его не нужно
+        try:
+            version = cache.incr(VERSION_KEY)
+        except ValueError:
+            version = 1
+            cache.set(VERSION_KEY, version, timeout=None)
+        if self.version is not None and self.version + 1 == version:
+            self.version = version
+
+    def update(self, user):
+        with self.lock:
+            self._remove(user.pk)
+            if user.is_active:
+                self._add(user.pk, user.username, user.first_name, user.last_name)
+        self._bump()
+
+    def remove(self, pk):
+        with self.lock:
+            self._remove(pk)
+        self._bump()
+
+    def _expired(self):
+        max_age = settings.AUTOCOMPLETE_MAX_AGE
+        return max_age is not None and time.monotonic() - self.loaded_at > max_age
+
+    def search(self, query, limit=LIMIT):
+        prefix = normalize(query)
+        if not prefix:
+            return []
+        if self.version is None or cache.get(VERSION_KEY) != self.version or self._expired():
+            self.load()
+        found = []
+        with self.lock:
+            i = bisect.bisect_left(self.entries, (prefix,))
+            while i < len(self.entries) and len(found) < limit:
+                term, username, pk = self.entries[i]
+                if not term.startswith(prefix):
+                    break
+                if pk not in found:
+                    found.append(pk)
+                i += 1
+            return [(self.users[pk][0], self.users[pk][1]) for pk in found]
+
+
+index = PrefixIndex()
+
+
+def invalidate():
+    """Перечитать индекс во всех процессах: например, после массовой загрузки пользователей"""
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, 1, timeout=None)
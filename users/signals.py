@@ -0,0 +1,19 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .autocomplete import index
+
+User = get_user_model()
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, update_fields, **kwargs):
+    # вход в систему меняет только last_login, индекс от него не зависит
+    if update_fields is None or set(update_fields) != {'last_login'}:
+        index.update(instance)
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    index.remove(instance.pk)
@@ -1,3 +1,65 @@
-from django.test import TestCase
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, Client, override_settings
+from django.urls import reverse
 
-# Create your tests here.
+from .autocomplete import index
+
+User = get_user_model()
+
+
+class TestAutocomplete(TestCase):
+    def setUp(self):
+        cache.clear()  # откат транзакции теста не сбрасывает версию индекса
+        self.client = Client()
+        User.objects.create_user(username='ivanov', first_name='Иван', last_name='Петров', password='1235678')
+        User.objects.create_user(username='ivan_s', first_name='Иван', last_name='Сидоров', password='1235678')
+        User.objects.create_user(username='petrova', first_name='Анна', last_name='Петрова', password='1235678')
+
+    def usernames(self, query, **params):
+        response = self.client.get(reverse('autocomplete'), {'q': query, **params})
+        self.assertEqual(response.status_code, 200)
+        return [found['username'] for found in response.json()['results']]
+
+    def test_prefix_of_username_and_names(self):
+        self.assertEqual(self.usernames('iva'), ['ivan_s', 'ivanov'])
+        self.assertEqual(sorted(self.usernames('иВа')), ['ivan_s', 'ivanov'])
+        self.assertEqual(sorted(self.usernames('петр')), ['ivanov', 'petrova'])
+        self.assertEqual(self.usernames('иван сид'), ['ivan_s'])
+        self.assertEqual(self.usernames(''), [])
+        self.assertEqual(self.usernames('zzz'), [])
+
+    def test_limit(self):
+        self.assertEqual(len(self.usernames('i', limit=1)), 1)
+        self.assertEqual(len(self.usernames('i', limit='x')), 2)
+
+    def test_index_follows_user_changes(self):
+        self.usernames('iva')
+        user = User.objects.get(username='petrova')
+        user.username = 'anna'
+        user.save()
+        self.assertEqual(self.usernames('petrova'), [])
+        self.assertEqual(self.usernames('анна'), ['anna'])
+        self.assertEqual(self.usernames('ann'), ['anna'])
+        user.delete()
+        self.assertEqual(self.usernames('ann'), [])
+
+    def test_other_process_change_reloads_index(self):
+        self.usernames('iva')
+        User.objects.filter(username='ivanov').update(username='ivanovich')
+        cache.incr('autocomplete:users:version')  # так правку видит другой процесс
+        self.assertEqual(self.usernames('ivanov'), ['ivanovich'])
+
+    def test_index_expires_without_shared_cache(self):
+        # с кешем процесса версию из другого процесса не увидеть — спасает срок
+        with override_settings(AUTOCOMPLETE_MAX_AGE=None):
+            self.usernames('iva')
+            User.objects.filter(username='ivanov').update(username='ivanovich')
+            self.assertEqual(self.usernames('ivanov'), ['ivanov'])
+        with override_settings(AUTOCOMPLETE_MAX_AGE=0):
+            self.assertEqual(self.usernames('ivanov'), ['ivanovich'])
+
+    def test_search_needs_no_queries(self):
+        index.load()
+        with self.assertNumQueries(0):
+            self.usernames('iva')
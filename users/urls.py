@@ -3,5 +3,6 @@ from . import views
 
 
 urlpatterns = [
-    path("signup/", views.SignUp.as_view(), name="signup")
+    path("signup/", views.SignUp.as_view(), name="signup"),
+    path("autocomplete/", views.autocomplete, name="autocomplete"),
 ]
\ No newline at end of file
@@ -1,16 +1,32 @@
+from django.http import JsonResponse
 from django.shortcuts import render
 #  импортируем CreateView, чтобы создать ему наследника
 from django.views.generic import CreateView
 
 #  функция reverse_lazy позволяет получить URL по параметру "name" функции path()
 #  берём, тоже пригодится
-from django.urls import reverse_lazy
+from django.urls import reverse, reverse_lazy
 
 #  импортируем класс формы, чтобы сослаться на неё во view-классе
 from .forms import CreationForm
+from .autocomplete import LIMIT, MAX_LIMIT, index
 
 
 class SignUp(CreateView):
     form_class = CreationForm
     success_url = reverse_lazy("login") #  где login — это параметр "name" в path()
-    template_name = "signup.html"
\ No newline at end of file
+    template_name = "signup.html"
+
+
+def autocomplete(request):
+    """Подсказки авторов по началу логина, имени или фамилии: ?q=ива&limit=10"""
+    try:
+        limit = int(request.GET.get('limit', LIMIT))
+    except ValueError:
+        limit = LIMIT
+    limit = max(1, min(limit, MAX_LIMIT))
+    found = index.search(request.GET.get('q', ''), limit)
+    return JsonResponse({'results': [
+        {'username': username, 'name': name, 'url': reverse('profile', kwargs={'username': username})}
+        for username, name in found
+    ]})
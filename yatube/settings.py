@@ -50,13 +50,17 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # первым, чтобы время ответа включало всю остальную обработку
+    'posts.metrics.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
+    'django.middleware.http.ConditionalGetMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'posts.pagecache.AnonymousPageCacheMiddleware',
 ]
 
 ROOT_URLCONF = 'yatube.urls'
@@ -72,6 +76,8 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'posts.context_processors.feed_cache',
+                'posts.context_processors.live_feed',
             ],
         },
     },
@@ -148,8 +154,107 @@ EMAIL_FILE_PATH = os.path.join(BASE_DIR, "sent_emails")
 
 SITE_ID = 1
 
-CACHES = {
-    'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-    },
-}
\ No newline at end of file
+# Версии данных (posts/versions.py), по которым сбрасываются фрагменты лент
+# и страницы, и версия индекса автодополнения хранятся в этом кеше. Если
+# процессов сервера несколько, кеш обязан быть общим (Memcached, адрес в
+# YATUBE_MEMCACHED, например 127.0.0.1:11211): у LocMemCache он свой в
+# каждом процессе, и сброс в одном процессе другие не увидят.
+MEMCACHED_LOCATION = os.environ.get('YATUBE_MEMCACHED')
+if MEMCACHED_LOCATION:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+            'LOCATION': MEMCACHED_LOCATION,
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+    }
+
+# записей на странице ленты
+POSTS_PER_PAGE = 10
+# фрагменты лент и страницы для анонимных читателей сбрасываются версиями
+# данных, поэтому с общим кешем могут жить долго; с кешем процесса короткий
+# срок ограничивает, сколько другие процессы показывают устаревшее
+FEED_CACHE_TIMEOUT = 60 * 60 * 6 if MEMCACHED_LOCATION else 20
+PAGE_CACHE_TIMEOUT = 60 * 60 if MEMCACHED_LOCATION else 20
+# сколько живёт версия данных. Из версий строятся и валидаторы ETag и
+# Last-Modified: с кешем процесса чужой процесс не увидит сброса и отвечал
+# бы 304 на устаревшую страницу бесконечно. Истёкшая версия заменяется
+# текущим временем, и валидаторы меняются; None — только общий кеш
+VERSION_TIMEOUT = None if MEMCACHED_LOCATION else FEED_CACHE_TIMEOUT
+# через сколько секунд индекс автодополнения перечитывается, даже если
+# версия в кеше не менялась; None — только по версии (нужен общий кеш)
+AUTOCOMPLETE_MAX_AGE = None if MEMCACHED_LOCATION else 60
+
+
+# Лента подписок
+
+# сколько последних постов автора попадает в ленту при подписке
+TIMELINE_BACKFILL_LIMIT = 1000
+
+# авторам с большим числом подписчиков посты не раскладываются по лентам,
+# а подмешиваются в ленту подписок при чтении
+TIMELINE_FANOUT_MAX_FOLLOWERS = 10000
+
+
+# Живые ленты (Server-Sent Events)
+
+# каждая открытая лента держит поток /events/, а с ним поток или воркер
+# сервера, на всё время соединения. Включать только под асинхронным или
+# многопоточным сервером (gunicorn с gthread/gevent, uvicorn и т. п.):
+# на синхронных воркерах несколько вкладок займут их все
+LIVE_FEED_ENABLED = False
+# сколько держать открытым один поток, потом клиент переподключается
+EVENTS_STREAM_SECONDS = 60
+# как часто слать комментарий-пинг, чтобы прокси не закрыли тихое соединение
+EVENTS_KEEPALIVE_SECONDS = 15
+# через сколько миллисекунд браузеру переподключаться
+EVENTS_RETRY_MS = 3000
+
+
+# Миниатюры картинок постов
+
+# загруженная картинка уменьшается до этого размера по большей стороне и
+# пересохраняется без метаданных; картинки больше POST_IMAGE_MAX_PIXELS
+# точек не принимаются вовсе — их распаковка съела бы всю память
+POST_IMAGE_MAX_SIZE = 2560
+POST_IMAGE_MAX_PIXELS = 40 * 1000 * 1000
+POST_IMAGE_UPLOAD_QUALITY = 85
+
+# размеры, которые готовятся сразу после загрузки картинки
+POST_THUMBNAILS = (
+    ('960x339', {'crop': 'center', 'upscale': True}),
+)
+# ширины адаптивных вариантов картинки (srcset) и качество их сжатия
+POST_IMAGE_WIDTHS = (320, 640, 960, 1280)
+POST_IMAGE_QUALITY = 80
+# сколько найденных миниатюр держать в памяти процесса
+POST_THUMBNAIL_LRU_SIZE = 10000
+# процессов в пуле миниатюр; 0 — делать миниатюры сразу, в том же процессе
+POST_THUMBNAIL_WORKERS = 2
+# сколько секунд помнить, что миниатюры ещё нет. Пул пишет готовую через
+# свой кеш, и без общего кеша отметку о промахе в процессе сервера никто
+# не сотрёт: её срок и есть задержка, с которой миниатюра появится в ленте
+POST_THUMBNAIL_MISS_TIMEOUT = 5
+# картинку, которую загружали (в том числе повторно) меньше стольких секунд
+# назад, release_image не удаляет: её может ждать пост в незакоммиченной
+# транзакции, а такой файл лучше оставить лишним, чем потерять
+POST_IMAGE_RELEASE_GRACE = 10 * 60
+
+
+# Журнал медленных запросов
+
+# SQL-запросы дольше стольких миллисекунд пишутся в журнал; None — не писать
+SLOW_QUERY_MS = 200
+# файл журнала, по строке JSON на запрос; сводка — команда slow_queries
+SLOW_QUERY_LOG = os.path.join(BASE_DIR, 'slow_queries.jsonl')
+# писать ли в журнал параметры запросов: в них логины, почта, тексты
+# постов и хеши паролей, поэтому по умолчанию журнал хранит только SQL
+SLOW_QUERY_LOG_PARAMS = False
+# доля медленных запросов, попадающих в журнал, и предел записей в минуту
+SLOW_QUERY_SAMPLE = 1.0
+SLOW_QUERY_MAX_PER_MINUTE = 60